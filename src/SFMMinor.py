@@ -54,9 +54,9 @@ def execute():
             outfile.write(sfm_records.header)
 
             for rec in recs:
-                r = rec.as_lists()
                 is_minor = rec.find_first(MINOR_MKRS)
                 if is_minor:
+                    r = rec.as_lists()
                     minlx = r[0][1].strip()
                     report = "Probable minor entry {} identified due to link {}".format(minlx, str(is_minor))
                     #Strip it down to ASCII so the console can handle it
@@ -77,6 +77,7 @@ def execute():
                                     #The following needs to be stripped down to ASCII
                                     #print("  Updating the minor entry by appending {} to marker {}.".format(bref, is_minor[0]))
                                     is_minor[0] += bref
+                                    rec.changed()  # renamed a marker in place
 #                                print(rec.as_string())
                                 break
                 
@@ -54,6 +54,8 @@ def get_args():
                         help=HELP_UNDO_PUSH + ' Causes -p to be ignored.')
     parser.add_argument('-p', '--pushpsdown', dest='pushpsdown', default=False, action='store_const', const=True, 
                         help=HELP_PUSH)
+    parser.add_argument('-d', '--delta', default=False, action='store_true',
+                        help='save only the changed records (with their line numbers and original text) as a patch; see SFMUtils/ApplyDelta.py')
     return vars(parser.parse_args())
 
 
@@ -286,13 +288,25 @@ def execute(args):
         recs = split_out_subentries(sfm_records)
         print("Running the selected function (described below)...\n" + msg)
         
-        with open (out_fname, mode='w', encoding='utf-8') as outfile:
+        def write_output(outfile):
             outfile.write(sfm_records.header)
 
             for record in recs:
                 outfile.write(func(record))
 #                outfile.write('\n\n=====\n')
 #                outfile.write(record.as_string())  #to see the subentry breaks
+
+        if args.get('delta'):
+            # Compare the output with the original as it's written, and save just the changed records.
+            with open(in_fname, encoding='utf-8') as original, open(out_fname, mode='w', encoding='utf-8', newline='') as patchfile:
+                writer = sfm.SFMDeltaWriter(original, patchfile, REC_MKR)
+                write_output(writer)
+                hunks = writer.finish()
+            print('Done. Saved just the changes, as {} run(s) of records, to this file: {}'.format(hunks, out_fname))
+            print('To apply them: python SFMUtils/ApplyDelta.py {} {} <new file>'.format(in_fname, out_fname))
+            return
+        with open (out_fname, mode='w', encoding='utf-8') as outfile:
+            write_output(outfile)
         
     print('Done. Output saved to this file: {}'.format(out_fname))
 
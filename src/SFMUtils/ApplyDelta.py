@@ -0,0 +1,43 @@
+#! /usr/bin/python3
+
+'''This Python 3.x script applies a delta (patch) file, such as ApplyRE.py -d saves, to the original SFM file
+it was made from: it copies the original to the output file in one pass, replacing just the records listed in the
+patch. It refuses to apply a patch that doesn't match the original (e.g. if the original has been edited since).
+
+Each change in the patch is listed as a hunk: a line like this
+@@ 1207 5 -92 +96
+(meaning that 92 characters of original text, beginning at line 1207 and spanning 5 lines, are replaced by 96
+characters of new text) followed by the original text and then the new text. So the patch can also be read
+(but not edited, since the counts would then be wrong) as a summary of what changed.
+
+Sample command-line calls (the first just displays help; the second creates output.txt):
+python ApplyDelta.py -h
+python ApplyDelta.py -o input.txt changes.txt output.txt
+'''
+
+import argparse, os
+
+import SFMTools as sfm
+
+def get_args():
+    ''' Parse the command line arguments. '''
+    parser = argparse.ArgumentParser(description='Apply a delta (patch) file of changed SFM records to the original file.')
+    parser.add_argument('infile', help='the original file')
+    parser.add_argument('deltafile', help='the delta file (e.g. from ApplyRE.py -d)')
+    parser.add_argument('outfile', help='the output file to save to')
+    parser.add_argument('-o', '--overwrite', dest='overwr', default=False, action='store_true',
+                        help='overwrite the output file, if it already exists')
+    return vars(parser.parse_args())
+
+def execute(args):
+    if not args['overwr'] and os.path.exists(args['outfile']):
+        print("Output file already exists! Aborted.")
+        return
+    with open(args['infile'], encoding='utf-8') as original, open(args['deltafile'], encoding='utf-8', newline='') as delta, \
+            open(args['outfile'], mode='w', encoding='utf-8') as outfile:
+        hunks = sfm.apply_delta(original, delta, outfile)
+    print("Done. Applied {} change(s).".format(hunks))
+
+if __name__ == '__main__':
+    args = get_args() #get args as a dictionary
+    execute(args)
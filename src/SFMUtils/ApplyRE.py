@@ -14,6 +14,11 @@ Sample command-line calls (the first just displays help, the second converts
 input.txt to output.txt, overwriting it if it's there):
 python ApplyRE.py -h
 python ApplyRE.py -o input.txt output.txt
+python ApplyRE.py -o -s input.txt output.txt    (streaming: for very large files)
+python ApplyRE.py -o -c input.txt output.txt    (caches results in input.txt.applyre.cache, so re-runs after small edits are fast)
+python ApplyRE.py -o -d input.txt changes.txt    (saves just the changed records; ApplyDelta.py can apply them later)
+python ApplyRE.py -o -f input.txt output.txt    (fuses independent broad regexes into fewer passes; --verify-fusion checks that's safe)
+python ApplyRE.py -o -p input.txt output.txt    (also saves output.txt.profile.json and .csv, measuring each regex)
 
 In Windows, you may want to create a batch file that you can easily double-click to run this. But don't name it ApplyRE.bat
 Example 1:
@@ -25,7 +30,14 @@ pause
 
 '''
 
-import re, argparse, os, io
+import re, argparse, os, io, csv, json, hashlib
+from time import perf_counter, process_time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from re import _parser as sre_parse  # (Python 3.11+)
+except ImportError:
+    import sre_parse
 
 # CONSTANTS:
 
@@ -33,9 +45,13 @@ STOP_IGNORING = '}}'
 RECORD_MARKER = 'lx'
 REGEX_DESC = '##'
 BROAD = 'broad'  
+RECORD_LOCAL = 'record'  # e.g. 'broad: record' marks a broad regex that can never match across record boundaries
 NARROW = 'sfmval'
 NARROW_NON_SPECIFIC = 'sfmval'  
 DISABLED = 'disable' # just needs to start with this; e.g. "DISABLED" is fine--better, actually.
+STREAM_CHUNK = 1 << 20  # in streaming mode, how many characters to read from the input file at a time
+CACHE_EXT = '.applyre.cache'  # with -c, the cache is saved next to the input file, with this added to its name
+CACHE_VERSION = 3  # change this whenever a change to this script could change the output; old caches are then ignored
 
 INFILE='lexicon.txt'
 OUTFILE='lexicon-out.tmp.txt'
@@ -53,6 +69,51 @@ def ascii(s):
         s3 = "~" + s3
     return s3
 
+def _literal_runs(parsed):
+    '''Return a list of literal strings that any match of this (sre_parse'd) pattern must contain.'''
+    runs, run = [], ''
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            run += chr(av)
+            continue
+        runs.append(run)
+        run = ''
+        if op is sre_parse.SUBPATTERN and not (len(av) == 4 and av[1] & sre_parse.SRE_FLAG_IGNORECASE):
+            runs += _literal_runs(av[-1])  #a group's contents are required, unless it's a case-insensitive group
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            runs += _literal_runs(av[2])  #repeated at least once, so required
+    runs.append(run)
+    return runs
+
+def required_literal(compiled):
+    '''Return the longest literal string that every match of the compiled regex must contain, or None if
+    there isn't one (or it isn't safe to look for one, e.g. the regex ignores case).
+    If this string isn't found in some text, the regex certainly won't match it.'''
+    if compiled.flags & re.IGNORECASE:
+        return None
+    try:
+        runs = _literal_runs(sre_parse.parse(compiled.pattern, compiled.flags))
+    except Exception:  # (the parser is an internal module; if it surprises us, just don't prefilter)
+        return None
+    return max(runs, key=len) or None
+
+class RegexProfile:
+    '''Measurements of the work one regex did during a run (see the --profile option). Times are in seconds.'''
+    FIELDS = ('wall', 'cpu', 'fields_out_of_scope', 'fields_scanned', 'chars_scanned', 'substitutions', 'fields_changed')
+    __slots__ = FIELDS
+
+    def __init__(self):
+        for name in self.FIELDS:
+            setattr(self, name, 0)
+
+    def add(self, other):
+        ''' Add another profile's measurements (e.g. from a worker process) to this one. '''
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
 	
 class RegExpression:
     '''A simple class that compiles a regular expression's find string and stores it along with its other data
@@ -64,16 +125,22 @@ class RegExpression:
     Author: Jonathan Coombs <jonathan_coombs@sil.org>
     '''
 
-    def __init__(self, find_this, replace_with, fields, flags = re.LOCALE | re.MULTILINE | re.UNICODE):  #removed first part: re.DOTALL | 
+    def __init__(self, find_this, replace_with, fields, flags = re.MULTILINE | re.UNICODE):  #removed first part: re.DOTALL | . Also re.LOCALE, which Python 3.6+ rejects for str patterns
         self._find = re.compile(find_this,flags)
         self._findstr = find_this #just for visual reference
         self._replace = replace_with
+        self._literal = required_literal(self._find)  #text without this in it can be skipped
+        self.skipped = 0  #how many fields (or, if broad, whole passes) were skipped because the literal wasn't there
+        self.profile = None  #set this to a RegexProfile to have the work this regex does measured
+        self.scope = fields
         
         self._fields = list()
+        self.record_local = False
         f = fields.lower()
         if f.startswith(BROAD):
             self.narrow = False  # Broad; should apply to the whole file.
             self._narrow_specific = False
+            self.record_local = RECORD_LOCAL in f[len(BROAD):].replace(':', ' ').split()  # safe to apply to a few records at a time
         elif f.startswith(NARROW + ':') or f.startswith(NARROW + ' '):
             self.narrow = True
             self._narrow_specific = True
@@ -93,9 +160,12 @@ class RegExpression:
         if self.narrow: 
             raise Exception('This regex is not intended to be applied broadly to the whole file.')
         f, rw = self._find, self._replace
+        if self._literal is not None and self._literal not in data:
+            self.skipped += 1
+            return data, 0
         #TODO: Is there a better way to do the following? Presumably this hogs memory, but maybe that's necessary. It performs very fast.
         try:
-            ret = f.subn(rw, data, 0)
+            ret = self._subn(data, False)
         except:
             print('Error applying regex: \n{}\n{}'.format(self._findstr, rw))
             raise
@@ -105,6 +175,8 @@ class RegExpression:
     def apply_narrowly(self, record):
         '''Apply self's regular expression to the data portions of the supplied SFM record. SFM markers will NOT be affected.
         
+        The record can be an SFMTools.SFMRecord, or a list of [marker, value] lists (such as SFMRecord.as_lists() returns).
+        An SFMRecord is only modified (via set_value) where a replacement is made, so unchanged records keep their cached text.
         Scope: if specific fields were listed for this regex, perform the replace on only those fields' contents 
         '''
 
@@ -112,28 +184,752 @@ class RegExpression:
             raise Exception('This regex is intended to be applied broadly to the whole file, NOT narrowly.')
         
         i, count = 0, 0
+        fields = record.fields() if hasattr(record, 'fields') else record
         
-        for mkr, field_data in record:
+        literal = self._literal
+        for mkr, field_data in fields:
             #apply the regular expression to this field's data area.
             if (not self._narrow_specific) or (mkr in self._fields):
-                field_data, c = self._find.subn(self._replace, field_data, 0)
+                if literal is not None and literal not in field_data:
+                    self.skipped += 1
+                    i += 1
+                    continue
+                field_data, c = self._subn(field_data)
                 if c:
-                    record[i] = [mkr, field_data]  #update that line within the stored record
+                    if fields is record:
+                        record[i] = [mkr, field_data]  #update that line within the stored record
+                    else:
+                        record.set_value(i, field_data)
                     count += c
+            elif self.profile is not None:
+                self.profile.fields_out_of_scope += 1
             i += 1
         return record, count
 
-from time import clock
+    def _subn(self, text, field=True):
+        '''Do the substitution on some text (a field's contents, unless field is False), measuring it if profiling.'''
+        prof = self.profile
+        if prof is None:
+            return self._find.subn(self._replace, text, 0)
+        wall, cpu = perf_counter(), process_time()
+        new_text, count = self._find.subn(self._replace, text, 0)
+        prof.wall += perf_counter() - wall
+        prof.cpu += process_time() - cpu
+        prof.fields_scanned += field
+        prof.chars_scanned += len(text)
+        prof.substitutions += count
+        if field and count and new_text != text:
+            prof.fields_changed += 1
+        return new_text, count
+
+def _reparses_same(record):
+    '''Return True if writing out this record and reading it back in (as happens between narrow regexes that are
+    applied one at a time) would give exactly the same fields. Unchanged records always do.'''
+    if not record.is_modified():
+        return True
+    for mkr, value in record.fields():
+        if not _field_reparses_same(mkr, value):
+            return False
+    return True
+
+def _field_reparses_same(mkr, value):
+    '''Return True if this field, written out and read back in, would come back the same (and as a single field).'''
+    # SFMRecord.as_string writes a space between the two unless the value begins with a newline; SFMTools.break_field
+    # ends the marker at the first space (if any; otherwise, at the first newline).
+    if not mkr or not value.endswith('\n') or '\n\\' in value:
+        return False
+    if value.startswith('\n'):
+        return ' ' not in value and '\n' not in mkr
+    return True
+
+class NarrowPass:
+    '''Applies one narrow regex to a stream of records, passing on the records as the next regex should see them:
+    as if the data had been written out and parsed again. That only needs doing for records that have changed in
+    a way that matters (e.g. a newline was removed or a new field was started); these are re-parsed, along with
+    any following records they'd run into. If final is True, there is no next regex, so records are passed on just as
+    they are (to be written out as is). The number of modifications made is kept in count.'''
+
+    def __init__(self, regex, final=False):
+        self.regex = regex
+        self.final = final
+        self.count = 0
+        self._pending, self._location = '', None  #text still to be re-parsed, and where it began
+
+    def _reparse(self):
+        import SFMTools as sfm
+        record = sfm.SFMRecord(list(sfm.SFMBufferReader(self._pending)), self._location)
+        self._pending = ''
+        return [record]
+
+    def push(self, record):
+        '''Apply the regex to one record; return a list of any records that are now ready to pass on.'''
+        record, count = self.regex.apply_narrowly(record)
+        self.count += count
+        if not self._pending and (self.final or _reparses_same(record)):
+            return [record]
+        if not self._pending: self._location = record.location
+        self._pending += record.as_string()
+        if self._pending.endswith('\n'):  #safe to re-parse; the next record can't run into it
+            return self._reparse()
+        return []
+
+    def flush(self):
+        '''At the end of the data, return any records still being held.'''
+        return self._reparse() if self._pending else []
+
+class NarrowChain:
+    '''A series of consecutive narrow regexes, compiled into a table from each marker to the regexes (in order)
+    that apply to its fields. Each field is then only run through the regexes that can affect it, and each
+    record goes through the whole chain at once.
+
+    That's only done when it gives the same result as applying the regexes one at a time, with a write-out and
+    re-parse in between. A record that changes in a way that would affect the re-parse goes through a NarrowPass
+    for each regex instead (as do any records that follow it while those passes are holding records).
+    '''
+
+    def __init__(self, regexes):
+        self.regexes = regexes
+        self.passes = [NarrowPass(regex, final=(k == len(regexes) - 1)) for k, regex in enumerate(regexes)]
+        chain = list(enumerate(regexes))
+        self.default = [(k, regex) for k, regex in chain if not regex._narrow_specific]  #for any other marker
+        self.dispatch = {}
+        for regex in regexes:
+            for mkr in regex._fields:
+                self.dispatch[mkr] = [(k, r) for k, r in chain if not r._narrow_specific or mkr in r._fields]
+
+    @property
+    def counts(self):
+        ''' The number of modifications made so far by each regex. '''
+        return [narrow_pass.count for narrow_pass in self.passes]
+
+    def _apply(self, record):
+        '''Try applying the whole chain to the record, field by field. Return True if that worked, or False (leaving
+        the record unchanged) if it must go through the passes one at a time instead.'''
+        if record.is_modified() and not _reparses_same(record):
+            return False  #(it won't be written out exactly as it was read in)
+        changes, counts, skipped = [], [], []
+        last = len(self.regexes) - 1
+        dispatch, default = self.dispatch, self.default
+        fields = record.fields()
+        for i, (mkr, value) in enumerate(fields):
+            new_value = value
+            for k, regex in dispatch.get(mkr, default):
+                if regex._literal is not None and regex._literal not in new_value:
+                    skipped.append(regex)
+                    continue
+                new_value, c = regex._subn(new_value)
+                if c:
+                    if k < last and not _field_reparses_same(mkr, new_value):  #(the next regex would see a re-parsed record)
+                        return False
+                    counts.append((k, c))
+            if new_value != value:
+                changes.append((i, new_value))
+        for i, value in changes:
+            record.set_value(i, value)
+        for k, c in counts:
+            self.passes[k].count += c
+        for regex in skipped:
+            regex.skipped += 1
+        for regex in self.regexes:
+            if regex.profile is not None:
+                regex.profile.fields_out_of_scope += sum(1 for mkr, _value in fields if regex._narrow_specific and mkr not in regex._fields)
+        return True
+
+    def _through_passes(self, records, final=False):
+        for narrow_pass in self.passes:
+            records = [out for record in records for out in narrow_pass.push(record)]
+            if final:
+                records += narrow_pass.flush()
+        return records
+
+    def push(self, record):
+        '''Apply the chain to one record; return a list of any records that are now ready to be written out.'''
+        if not any(narrow_pass._pending for narrow_pass in self.passes) and self._apply(record):
+            return [record]
+        return self._through_passes([record])
+
+    def flush(self):
+        '''At the end of the data, return any records still being held.'''
+        return self._through_passes([], final=True)
+
+def apply_narrow_chain(regexes, data, record_marker=RECORD_MARKER):
+    '''Apply a series of narrow regexes to the data, parsing it just once: each record goes through the whole
+    chain before it's written out. Return the new data and a list of modification counts (one per regex).
+
+    The result is exactly the same as applying the regexes one at a time, with a parse and write-out for each.
+    '''
+    data, counts, _skipped, _held = _narrow_chunk(regexes, data, record_marker)
+    return data, counts
+
+def _narrow_chunk(regexes, data, record_marker=RECORD_MARKER):
+    '''Do the work of apply_narrow_chain (possibly in a worker process, on one chunk of the data). Return the new data,
+    the modification counts, how many fields each regex skipped, and whether any records were still being held
+    at the end (i.e. whether the result might have been different if more records had followed).'''
+    import SFMTools as sfm
+    chain = NarrowChain(regexes)
+    skipped = [regex.skipped for regex in regexes]
+    sfm_records = sfm.SFMRecordReader(data, record_marker)
+    data_out = [sfm_records.header]
+    for sfm_record in sfm_records:
+        data_out += [record.as_string() for record in chain.push(sfm_record)]
+    held = any(narrow_pass._pending for narrow_pass in chain.passes)
+    data_out += [record.as_string() for record in chain.flush()]
+    skipped = [regex.skipped - n for regex, n in zip(regexes, skipped)]
+    if len(data_out) == 1:
+        return data, chain.counts, skipped, held  #no records (so, like applying them one at a time, don't drop anything)
+    return ''.join(data_out), chain.counts, skipped, held
+
+def apply_narrow_parallel(executor, regexes, data, record_marker=RECORD_MARKER, chunks=16):
+    '''Like apply_narrow_chain, but split the data (at record boundaries) into the specified number of chunks and
+    apply the regexes to them in the executor's worker processes. The chunks are put back together in order,
+    and the counts are summed.
+
+    In the rare case that a chunk ends with a record that a regex made run into the next one, the regexes
+    are just applied to the whole data instead, so that the result is still exactly the same.'''
+    pieces = split_records(data, record_marker, chunks)
+    if len(pieces) < 2:
+        return apply_narrow_chain(regexes, data, record_marker)
+    results = list(executor.map(_narrow_chunk_worker, [regexes] * len(pieces), pieces, [record_marker] * len(pieces)))
+    if any(held for _data, _counts, _skipped, held, _profiles in results[:-1]):
+        return apply_narrow_chain(regexes, data, record_marker)  #(the workers' profiles are discarded too, since this redoes their work)
+    for result in results:
+        for regex, profile in zip(regexes, result[-1]):
+            if profile is not None: regex.profile.add(profile)
+    counts = [0] * len(regexes)
+    for _data, chunk_counts, skipped, _held, _profiles in results:
+        counts = [a + b for a, b in zip(counts, chunk_counts)]
+        for regex, n in zip(regexes, skipped):
+            regex.skipped += n
+    return ''.join(result[0] for result in results), counts
+
+def _narrow_chunk_worker(regexes, data, record_marker):
+    '''Run _narrow_chunk in a worker process; also return each regex's profile of just this chunk (if profiling).'''
+    for regex in regexes:
+        if regex.profile is not None:
+            regex.profile = RegexProfile()
+    return _narrow_chunk(regexes, data, record_marker) + ([regex.profile for regex in regexes],)
+
+class _CharSet:
+    '''A set of characters (over-estimated where necessary), for working out whether two regexes could ever
+    touch the same text. Besides specific characters, it can contain whole classes (\\w, \\d, \\s) or anything.'''
+    CLASSES = {'word': lambda c: c.isalnum() or c == '_', 'digit': str.isdecimal, 'space': str.isspace}
+    CATEGORIES = {sre_parse.CATEGORY_WORD: 'word', sre_parse.CATEGORY_DIGIT: 'digit', sre_parse.CATEGORY_SPACE: 'space'}
+    RANGE_MAX = 0x3000  # larger ranges are just treated as anything
+
+    def __init__(self, chars=()):
+        self.chars, self.classes, self.any = set(chars), set(), False
+
+    def add_class(self, items):
+        '''Add the characters of a parsed [...] class.'''
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                self.chars.add(chr(av))
+            elif op is sre_parse.RANGE and av[1] - av[0] < self.RANGE_MAX:
+                self.chars.update(chr(c) for c in range(av[0], av[1] + 1))
+            elif op is sre_parse.CATEGORY and av in self.CATEGORIES:
+                self.classes.add(self.CATEGORIES[av])
+            else:  #(a negated class, \\S, etc.)
+                self.any = True
+
+    def contains(self, char):
+        return self.any or char in self.chars or any(self.CLASSES[name](char) for name in self.classes)
+
+    def update(self, other):
+        self.chars |= other.chars
+        self.classes |= other.classes
+        self.any = self.any or other.any
+
+    def __bool__(self):
+        return bool(self.chars or self.classes or self.any)
+
+    def intersects(self, other):
+        if self.any or other.any:
+            return bool(self and other)
+        if self.chars & other.chars:
+            return True
+        for a, b in ((self, other), (other, self)):
+            for name in a.classes:
+                if any(self.CLASSES[name](c) for c in b.chars):
+                    return True
+        return bool({'word', 'digit'} & self.classes and {'word', 'digit'} & other.classes or
+                    'space' in self.classes and 'space' in other.classes)
+
+class _NotFusable(Exception):
+    pass
+
+def _parse_template(template):
+    '''Split a replacement template into a list of literal strings (with any escapes, like \\n, interpreted) and
+    group numbers.'''
+    parts = []
+    for m in re.finditer(r'\\(?:g<(\d+)>|([1-9]\d?))|(?:\\(?!g<|[1-9]).|[^\\])+', template, re.DOTALL):
+        if m.group(1) or m.group(2):
+            parts.append(int(m.group(1) or m.group(2)))
+        else:
+            parts.append(re.sub('x', m.group(0), 'x'))
+    return parts
+
+def _walk_shape(parsed, consumed, context, widths):
+    '''Add to the consumed set every character the (sre_parse'd) pattern could match, and to the context set every
+    character that its assertions (^, $, \\b, lookarounds) look at. Record each group's minimum width.'''
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            consumed.chars.add(chr(av))
+        elif op in (sre_parse.NOT_LITERAL, sre_parse.ANY):
+            consumed.any = True
+        elif op is sre_parse.IN:
+            consumed.add_class(av)
+        elif op is sre_parse.BRANCH:
+            for branch in av[1]:
+                _walk_shape(branch, consumed, context, widths)
+        elif op is sre_parse.SUBPATTERN:
+            if len(av) == 4 and av[1] & sre_parse.SRE_FLAG_IGNORECASE:
+                raise _NotFusable()
+            if av[0]: widths[av[0]] = av[-1].getwidth()[0]
+            _walk_shape(av[-1], consumed, context, widths)
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)):
+            _walk_shape(av[2], consumed, context, widths)
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            _walk_shape(av, consumed, context, widths)
+        elif op is sre_parse.AT:
+            if av in (sre_parse.AT_BEGINNING_LINE, sre_parse.AT_END_LINE, sre_parse.AT_END):
+                context.chars.add('\n')
+            elif av in (sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY):
+                context.classes.add('word')
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            _walk_shape(av[1], context, context, widths)
+        else:  #(e.g. a backreference, whose text depends on more than the characters where it is)
+            raise _NotFusable()
+
+def fusion_shape(regex):
+    '''For a broad regex, return (consumed, context, produced): the characters its matches can contain, the characters
+    its assertions look at, and the characters its replacements can contain. Return None if it can't be fused
+    with others at all (e.g. it can match an empty string, or a replacement could be empty).'''
+    compiled = regex._find
+    if regex.narrow or compiled.flags & re.IGNORECASE or compiled.groupindex:
+        return None
+    consumed, context, widths = _CharSet(), _CharSet(), {}
+    try:
+        parsed = sre_parse.parse(compiled.pattern, compiled.flags)
+        _walk_shape(parsed, consumed, context, widths)
+        widths[0] = parsed.getwidth()[0]
+        parts = _parse_template(regex._replace)
+    except (_NotFusable, re.error, ValueError):
+        return None
+    literal = ''.join(part for part in parts if isinstance(part, str))
+    refs = [part for part in parts if not isinstance(part, str)]
+    if not widths[0] or not (literal or any(widths.get(ref) for ref in refs)):
+        return None
+    produced = _CharSet(literal)
+    if refs: produced.update(consumed)
+    return consumed, context, produced
+
+def can_fuse(group, regex):
+    '''Return True if the broad regex can be added to a group of broad regexes that are applied in a single
+    pass (see BroadFusion) without changing the result. That's the case if the characters that each earlier
+    regex matches or produces can't be matched or looked at by this one, and no replacement is ever empty: then
+    neither regex can create, destroy or overlap a match of the other.'''
+    shape = fusion_shape(regex)
+    if shape is None or any(earlier._find.flags != regex._find.flags for earlier in group):
+        return False
+    for earlier in group:
+        earlier_shape = fusion_shape(earlier)
+        if earlier_shape is None:
+            return False
+        touched = _CharSet()
+        touched.update(earlier_shape[0])
+        touched.update(earlier_shape[2])
+        if touched.intersects(shape[0]) or touched.intersects(shape[1]):
+            return False
+    try:
+        re.compile('|'.join('(' + r._findstr + ')' for r in group + [regex]), regex._find.flags)
+    except re.error:  #(e.g. inline flags, which must come first)
+        return False
+    return True
+
+class BroadFusion:
+    '''A group of adjacent broad regexes (see can_fuse), applied in a single pass over the data by one alternation
+    of all of them. A callback works out which regex matched (from the first character of the match, since no two
+    of them can match the same character), and gives that regex's replacement. The result is the same as applying
+    them one at a time.'''
+
+    def __init__(self, regexes):
+        self.regexes = regexes
+        self.narrow = False
+        self.record_local = all(regex.record_local for regex in regexes)
+        self._consumed = None  #(what each regex's matches can consist of; worked out when first needed)
+        self._patterns = {}  #(compiled alternations, for each subset of the regexes that might match)
+
+    def _pattern(self, members):
+        '''Return the alternation of the specified regexes, and each one's replacement: either the replacement
+        text, or (if it refers to groups) a list of literal strings and group numbers, renumbered to match the
+        alternation's groups.'''
+        if members not in self._patterns:
+            templates, offset = {}, 0
+            for k in members:
+                regex = self.regexes[k]
+                parts = [part if isinstance(part, str) else part + offset if part else 0 for part in _parse_template(regex._replace)]
+                templates[k] = ''.join(parts) if all(isinstance(part, str) for part in parts) else parts
+                offset += regex._find.groups
+            alternation = '|'.join('(?:' + self.regexes[k]._findstr + ')' for k in members)
+            self._patterns[members] = re.compile(alternation, self.regexes[0]._find.flags), templates
+        return self._patterns[members]
+
+    def _which(self, char, members, cache):
+        '''Return the index of the regex (among the members) whose matches can begin with this character.'''
+        if char not in cache:
+            if self._consumed is None:
+                self._consumed = [fusion_shape(regex)[0] for regex in self.regexes]
+            cache[char] = next(k for k in members if self._consumed[k].contains(char))
+        return cache[char]
+
+    def apply(self, data):
+        '''Apply all the regexes to the data. Return the new data and a list of modification counts (one per regex).'''
+        counts = [0] * len(self.regexes)
+        members = []
+        for k, regex in enumerate(self.regexes):
+            if regex._literal is not None and regex._literal not in data:
+                regex.skipped += 1
+            else:
+                members.append(k)
+        if len(members) < 2:
+            for k in members:
+                data, counts[k] = self.regexes[k].apply(data)
+            return data, counts
+        members = tuple(members)
+        pattern, templates = self._pattern(members)
+        cache = {}
+        def replace(m):
+            k = self._which(m.group()[0], members, cache)
+            counts[k] += 1
+            template = templates[k]
+            if template.__class__ is str:
+                return template
+            return ''.join([part if part.__class__ is str else m.group(part) or '' for part in template])
+        return pattern.sub(replace, data), counts
+
+def apply_broad(group, data):
+    '''Apply a group of broad regexes (see group_regexes). Return the new data and a list of modification counts.'''
+    if len(group) == 1:
+        data, count = group[0].apply(data)
+        return data, [count]
+    return BroadFusion(group).apply(data)
+
+def group_regexes(regexes, fuse=False):
+    '''Split the list of regexes into groups that can each be applied in a single pass: each broad regex
+    on its own, and any consecutive narrow regexes together. If fuse is True, consecutive broad regexes are
+    grouped too wherever can_fuse allows (if they're all record-local, or none are). Return a list of lists.'''
+    groups = []
+    for regex in regexes:
+        if groups and regex.narrow and groups[-1][-1].narrow:
+            groups[-1].append(regex)
+        elif (fuse and groups and not regex.narrow and not groups[-1][-1].narrow and
+              regex.record_local == groups[-1][-1].record_local and can_fuse(groups[-1], regex)):
+            groups[-1].append(regex)
+        else:
+            groups.append([regex])
+    return groups
+
+def _is_record_start(data, pos, record_marker):
+    '''Return True if a field whose marker is the record marker begins at this offset.'''
+    import SFMTools as sfm
+    if pos and data[pos-1] != '\n':
+        return False
+    end = data.find('\n\\', pos)
+    end = len(data) if end == -1 else end + 1
+    return data[pos+1:sfm.break_pos(data, pos, end)[0]] == record_marker
+
+def _record_starts(data, record_marker):
+    '''Return the offsets (in the string) of the first and last fields that begin records, or (-1, -1) if
+    there are none.'''
+    prefix = '\\' + record_marker
+    first = last = len(data)
+    while first != -1:
+        first = data.find(prefix, 0 if first == len(data) else first + 1)
+        if first != -1 and _is_record_start(data, first, record_marker): break
+    while last != -1:
+        last = data.rfind(prefix, 0, last)
+        if last != -1 and _is_record_start(data, last, record_marker): break
+    return first, last
+
+def split_records(data, record_marker=RECORD_MARKER, chunks=16):
+    '''Split the data into (at most) the specified number of pieces of roughly equal size, each one beginning
+    with a record (except the first, which also has any header). Return a list of strings.'''
+    prefix = '\\' + record_marker
+    first = _record_starts(data, record_marker)[0]
+    bounds = [0]
+    if first != -1:
+        size = len(data) // chunks + 1
+        pos = first + 1
+        while True:
+            pos = data.find('\n' + prefix, max(pos, bounds[-1] + size))
+            if pos == -1: break
+            pos += 1
+            if _is_record_start(data, pos, record_marker):
+                bounds.append(pos)
+    bounds.append(len(data))
+    return [data[a:b] for a, b in zip(bounds, bounds[1:])]
+
+class StreamStage:
+    '''One step of a streaming run (see apply_streaming): a broad regex, or a group of consecutive narrow
+    regexes. Text is fed in as it arrives, and each complete run of records is processed and passed on as soon
+    as the start of the next record has been seen. So narrow regexes see exactly the fields they would see
+    when applied to the whole file at once.
+
+    A broad regex that isn't marked as record-local must see the whole file, so it holds on to everything
+    until finish() is called.'''
+
+    def __init__(self, regexes, record_marker=RECORD_MARKER):
+        self.regexes = regexes
+        self.record_marker = record_marker
+        self._chain = NarrowChain(regexes) if regexes[0].narrow else None
+        self._broad = None if regexes[0].narrow else BroadFusion(regexes)
+        self.whole = self._broad is not None and not self._broad.record_local
+        self._counts = [0] * len(regexes)  #(for broad regexes)
+        self._pieces = []  #the text being held, as it arrived (joined only when it's needed)
+
+    @property
+    def counts(self):
+        ''' The number of modifications made so far by each regex. '''
+        if self._chain is None:
+            return self._counts
+        return self._chain.counts
+
+    def _apply(self, data, final=False):
+        if self._chain is None:
+            data, counts = self._broad.apply(data)
+            self._counts = [a + b for a, b in zip(self._counts, counts)]
+            return data
+        # Any records the chain is still holding (because the next records might run into them) stay there
+        # until more data arrives, or until the end.
+        import SFMTools as sfm
+        data_out = []
+        if data:
+            sfm_records = sfm.SFMRecordReader(data, self.record_marker)
+            data_out.append(sfm_records.header)
+            for sfm_record in sfm_records:
+                data_out += [record.as_string() for record in self._chain.push(sfm_record)]
+        if final:
+            data_out += [record.as_string() for record in self._chain.flush()]
+        return ''.join(data_out)
+
+    def feed(self, data):
+        '''Take some more text, and return whatever text is now ready for the next stage.'''
+        pieces = self._pieces
+        prefix = '\\' + self.record_marker
+        # Only rescan the held text if a record could begin in the new data (or straddle its start).
+        rescan = not pieces or prefix in pieces[-1][-len(prefix):] + data
+        pieces.append(data)
+        if self.whole or not rescan: return ''
+        buffer = ''.join(pieces)
+        first, last = _record_starts(buffer, self.record_marker)
+        if last <= first:
+            self._pieces = [buffer]
+            return ''  #wait until we've seen the start of the record after this one
+        data, self._pieces = buffer[:last], [buffer[last:]]
+        return self._apply(data)
+
+    def finish(self):
+        '''Process and return any text still being held.'''
+        data, self._pieces = ''.join(self._pieces), []
+        if self._chain is None:
+            return self._apply(data) if data else ''
+        return self._apply(data, final=True)
+
+def apply_streaming(regexes, infile, outfile, record_marker=RECORD_MARKER, chunk_size=STREAM_CHUNK, fuse=False):
+    '''Apply the regexes while copying from one open file to another, a chunk of records at a time, so that
+    (unless some broad regex isn't marked as record-local) the whole file is never held in memory.
+    Return a list of modification counts (one per regex).'''
+    stages = [StreamStage(group, record_marker) for group in group_regexes(regexes, fuse)]
+    while True:
+        data = infile.read(chunk_size)
+        if not data:
+            break
+        for stage in stages:
+            if not data: break
+            data = stage.feed(data)
+        outfile.write(data)
+    data = ''
+    for stage in stages:  #end of input; flush everything through
+        data = stage.feed(data) + stage.finish()
+    outfile.write(data)
+    return [count for stage in stages for count in stage.counts]
+
+def _record_bounds(data, record_marker):
+    '''Return a list of the offsets of all the fields that begin records.'''
+    prefix = '\n\\' + record_marker
+    bounds = [0] if _is_record_start(data, 0, record_marker) else []
+    pos = data.find(prefix)
+    while pos != -1:
+        if _is_record_start(data, pos + 1, record_marker):
+            bounds.append(pos + 1)
+        pos = data.find(prefix, pos + 1)
+    return bounds
+
+def split_pieces(texts, record_marker=RECORD_MARKER):
+    '''Given a list of texts that (joined) make up a whole file, split them further into the file's header and its
+    records, and return a list of those. Return None if the texts' own boundaries can't be kept, i.e. if any text
+    but the first doesn't begin a record, or (since the next one would run into it) any text but the last doesn't
+    end with a newline.'''
+    pieces = []
+    for i, text in enumerate(texts):
+        if not text:
+            if i == 0: pieces.append('')  #(an empty header)
+            continue
+        if pieces and pieces[-1] and not pieces[-1].endswith('\n'):
+            return None
+        bounds = _record_bounds(text, record_marker)
+        if i == 0:
+            bounds = [0] + bounds
+        elif not bounds or bounds[0]:
+            return None
+        pieces += [text[a:b] for a, b in zip(bounds, bounds[1:] + [len(text)])]
+    return pieces
+
+class RecordCache:
+    '''An on-disk cache of what each step of a run (a broad regex, or a group of narrow ones; see group_regexes)
+    did to each record: its new text (or None if it didn't change) and the modification counts. Each entry is keyed
+    by a hash of the step's regexes and the record's text. So a re-run only has to apply the regexes to the records
+    that a changed regex (or an earlier step) sees differently.
+
+    Only the entries used or added by the latest run are saved, so the cache stays about the size of the file.
+    It's saved as plain JSON (not pickle, since loading a pickle can run arbitrary code, and the cache sits in the
+    same folder as the data, which may be shared). Anything in it that isn't a well-formed entry is ignored.'''
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.hits = self.misses = 0
+        self._old, self._new = {}, {}
+        try:
+            with open(fname, encoding='utf-8') as infile:
+                cached = json.load(infile)
+            if isinstance(cached, dict) and cached.get('version') == CACHE_VERSION:
+                self._old = self._valid_entries(cached.get('entries'))
+        except FileNotFoundError:
+            pass
+        except Exception as e:  #(e.g. a cache left incomplete by an earlier crash; just start afresh)
+            print('Ignoring the unreadable cache file {}: {}'.format(fname, e))
+
+    @staticmethod
+    def _valid_entries(entries):
+        '''Return a dict of just the well-formed entries: a key (a hex string) mapped to a new text (or None) and a list of counts.'''
+        valid = {}
+        if not isinstance(entries, dict):
+            return valid
+        for key, entry in entries.items():
+            if (isinstance(entry, list) and len(entry) == 2 and (entry[0] is None or isinstance(entry[0], str))
+                    and isinstance(entry[1], list) and all(type(n) is int and n >= 0 for n in entry[1])):
+                valid[key] = (entry[0], tuple(entry[1]))
+        return valid
+
+    def get(self, key, size=None):
+        '''Return the entry for this key, or None. (Also None if it doesn't have size counts, i.e. one per regex.)'''
+        entry = self._new.get(key) or self._old.get(key)
+        if entry is not None and size is not None and len(entry[1]) != size:
+            entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._new[key] = entry
+        return entry
+
+    def put(self, key, entry):
+        self._new[key] = entry
+
+    def save(self):
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as outfile:
+            json.dump({'version': CACHE_VERSION, 'entries': self._new}, outfile, separators=(',', ':'))
+        os.replace(tmp, self.fname)
+
+def _step_key(group, record_marker):
+    '''Return a hash of everything about a step (see RecordCache) that can affect its results.'''
+    rules = [(regex._findstr, regex._replace, regex.scope, regex._find.flags) for regex in group]
+    return hashlib.blake2b(repr((CACHE_VERSION, record_marker, rules)).encode('utf-8'), digest_size=32).digest()
+
+def _apply_pieces(group, pieces, record_marker):
+    '''Apply one step to each of a list of records (see split_pieces), as if each were on its own. Return a list
+    of cache entries, or None if some record was left in a state that the following record would run into.'''
+    if not group[0].narrow:
+        fusion = BroadFusion(group)
+        entries = [fusion.apply(piece) for piece in pieces]
+        return [(None if text == piece else text, tuple(counts)) for piece, (text, counts) in zip(pieces, entries)]
+    import SFMTools as sfm
+    chain = NarrowChain(group)
+    entries = []
+    for piece, record in zip(pieces, sfm.SFMRecordReader(''.join(pieces), record_marker)):
+        counts = chain.counts
+        text = ''.join(out.as_string() for out in chain.push(record))
+        if any(narrow_pass._pending for narrow_pass in chain.passes):
+            return None
+        entries.append((None if text == piece else text, tuple(b - a for a, b in zip(counts, chain.counts))))
+    return entries if len(entries) == len(pieces) else None
+
+def _apply_step_cached(group, pieces, record_marker, cache):
+    '''Apply one step to a list of pieces (see split_pieces), using and updating the cache. Return the new pieces
+    and the modification counts.
+
+    Where applying the step a record at a time wouldn't give the same result as applying it to the whole file
+    (e.g. a broad regex that isn't record-local, or a record that now runs into the next), the whole step
+    is just applied to all of the data instead, without the cache.'''
+    counts = [0] * len(group)
+    skipped = [regex.skipped for regex in group]
+    if (group[0].narrow and len(pieces) > 1) or all(regex.record_local for regex in group):  #(i.e. there are records, and it's record-local)
+        step = _step_key(group, record_marker)
+        first = 1 if group[0].narrow else 0  #(narrow regexes don't touch the header)
+        keys = [hashlib.blake2b(piece.encode('utf-8', 'surrogatepass'), digest_size=16, key=step).hexdigest() for piece in pieces[first:]]
+        entries = [cache.get(key, len(group)) for key in keys]
+        missed = [i for i, entry in enumerate(entries) if entry is None]
+        new_entries = _apply_pieces(group, [pieces[first + i] for i in missed], record_marker) if missed else []
+        if new_entries is not None:
+            for i, entry in zip(missed, new_entries):
+                entries[i] = entry
+                cache.put(keys[i], entry)
+            texts = pieces[:first]
+            for piece, (text, piece_counts) in zip(pieces[first:], entries):
+                texts.append(piece if text is None else text)
+                counts = [a + b for a, b in zip(counts, piece_counts)]
+            new_pieces = split_pieces(texts, record_marker)
+            if new_pieces is not None:
+                return new_pieces, counts
+    for regex, n in zip(group, skipped):
+        regex.skipped = n
+    data = ''.join(pieces)
+    if group[0].narrow:
+        data, counts = apply_narrow_chain(group, data, record_marker)
+    else:
+        data, counts = apply_broad(group, data)
+    return split_pieces([data], record_marker), counts
+
+def apply_cached(regexes, data, record_marker=RECORD_MARKER, cache=None, fuse=False):
+    '''Apply the regexes to the data (see RecordCache), reusing whatever results the cache has for its records.
+    Return the new data and a list of modification counts (one per regex); exactly as if the regexes had been
+    applied one at a time to the whole file.'''
+    pieces = split_pieces([data], record_marker)
+    counts = []
+    for group in group_regexes(regexes, fuse):
+        pieces, group_counts = _apply_step_cached(group, pieces, record_marker, cache)
+        counts += group_counts
+    return ''.join(pieces), counts
+
 class RoughTimer:
     ''' A class for measuring how well the find/replace operations perform. '''
     def __init__(self):
-        self.started = clock()       
+        self.started = perf_counter()       
     def just_elapsed(self):
-        tmp = clock()
+        tmp = perf_counter()
         diff = tmp - self.started
         self.started = tmp 
         return '{} ms'.format(diff*1000)
 
+def skip_note(regex):
+    ''' Describe how much work the literal-substring prefilter saved this regex (if any). '''
+    if not regex.skipped:
+        return ''
+    if regex.narrow:
+        return ' ({} fields skipped: no "{}")'.format(regex.skipped, ascii(regex._literal))
+    return ' (skipped: no "{}")'.format(ascii(regex._literal))
+
 def get_args():
     ''' Parse any command line arguments (all are optional). '''
     parser = argparse.ArgumentParser(description='Apply regular expressions to a file.')
@@ -145,6 +941,20 @@ def get_args():
     parser.add_argument('regexfile', default=REGEXFILE, nargs='?', help=tmp)
     parser.add_argument('-o', '--overwrite', dest='overwr', default=False, action='store_const', const=True, 
                         help='overwrite the output file, if it already exists')
+    parser.add_argument('-s', '--stream', default=False, action='store_true',
+                        help="process the file a chunk of records at a time instead of reading it all into memory (broad regexes should be marked 'broad: record')")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='apply narrow regexes using this many processes (default: 1; ignored with -s or -c)')
+    parser.add_argument('-c', '--cache', default=False, action='store_true',
+                        help="keep a cache (next to the input file) of what the regexes did to each record, so re-runs only redo what changed (ignored with -s; broad regexes should be marked 'broad: record')")
+    parser.add_argument('-d', '--delta', default=False, action='store_true',
+                        help='save only the changed records (with their line numbers and original text) as a patch; see ApplyDelta.py')
+    parser.add_argument('-f', '--fuse', default=False, action='store_true',
+                        help='apply adjacent broad regexes that cannot affect each other in a single pass (not with -p)')
+    parser.add_argument('--verify-fusion', default=False, action='store_true',
+                        help="just check that -f gives exactly the same results on the input file (doesn't save any output)")
+    parser.add_argument('-p', '--profile', default=False, action='store_true',
+                        help='measure each regex, and save the results next to the output file (as .profile.json and .profile.csv)')
     return vars(parser.parse_args())
 
 def get_regexes(fname):
@@ -237,6 +1047,72 @@ def run_sample(regexes):
     print_joined('AFTER:', record)
     
 
+@contextmanager
+def open_output(fnamein, fnameout, record_marker=RECORD_MARKER, delta=False):
+    '''Open the output file for writing. If delta is True, what gets written is compared with the input file as it
+    arrives, and only a patch listing the changed records is saved (see SFMTools.SFMDeltaWriter).'''
+    if not delta:
+        with open(fnameout, mode='w', encoding='utf-8') as outfile:
+            yield outfile
+        return
+    import SFMTools as sfm
+    with open(fnamein, encoding='utf-8') as original, open(fnameout, mode='w', encoding='utf-8', newline='') as outfile:
+        writer = sfm.SFMDeltaWriter(original, outfile, record_marker)
+        yield writer
+        hunks = writer.finish()
+    print('Saved just the changes, as {} run(s) of records. To apply them: python ApplyDelta.py {} {} <new file>'.format(hunks, fnamein, fnameout))
+
+def verify_fusion(regexes, data, record_marker=RECORD_MARKER):
+    '''Check, on the given data, that each group of broad regexes that would be fused (see can_fuse) gives exactly the
+    same result and counts fused as one at a time. Print what was checked (and how long each way took, since a
+    fused pass isn't always faster), and return True if all of them gave the same results.'''
+    ok, i, fused = True, 0, 0
+    for group in group_regexes(regexes, fuse=True):
+        numbers = '{} to {}'.format(i+1, i+len(group))
+        i += len(group)
+        if group[0].narrow:
+            data, _counts = apply_narrow_chain(group, data, record_marker)
+            continue
+        started = perf_counter()
+        expected, expected_counts = data, []
+        for regex in group:
+            expected, count = regex.apply(expected)
+            expected_counts.append(count)
+        if len(group) > 1:
+            fused += 1
+            separate, started = perf_counter() - started, perf_counter()
+            result, counts = BroadFusion(group).apply(data)
+            together = perf_counter() - started
+            same = result == expected and counts == expected_counts
+            print('  regexes {}: {} ({:.3f}s fused, {:.3f}s one at a time)'.format(numbers,
+                  'same result when fused' if same else 'DIFFERENT result when fused!', together, separate))
+            ok = ok and same
+        data = expected
+    if not fused:
+        print('  None of these broad regexes can be fused.')
+    return ok
+
+def write_profile(regexes, fnameout, elapsed):
+    '''Save the profile of each regex (see RegexProfile) as <fnameout>.profile.json and <fnameout>.profile.csv.
+    
+    Besides the measurements, each row identifies the regex, and fields_prefiltered says how many fields (or, if
+    broad, passes) it skipped because the regex's required literal text wasn't there. Work done on a record that then
+    had to be re-parsed (see NarrowChain) is counted as it was actually done, i.e. twice.
+    '''
+    rows = []
+    for i, regex in enumerate(regexes):
+        row = {'regex': i+1, 'find': regex._findstr, 'replace': regex._replace, 'scope': regex.scope, 'narrow': regex.narrow}
+        row.update(regex.profile.as_dict())
+        row['fields_prefiltered'] = regex.skipped
+        rows.append(row)
+    with open(fnameout + '.profile.json', mode='w', encoding='utf-8') as outfile:
+        json.dump({'output': fnameout, 'seconds': elapsed, 'regexes': rows}, outfile, indent=1)
+    with open(fnameout + '.profile.csv', mode='w', encoding='utf-8', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print('Saved the profile to {}.profile.json and .csv'.format(fnameout))
+
 def execute(args):    
     print('Running ApplyRE.py v0.2')
     fnamein = args['infile']
@@ -247,11 +1123,39 @@ def execute(args):
     some_narrow = False
     for regex in regexes:
         if regex.narrow: some_narrow = True
+        if args.get('profile'): regex.profile = RegexProfile()
+    started = perf_counter()
+    fuse = args.get('fuse') and not args.get('profile')  #(the profile is per regex)
     
     modcount=0
-    if not overwrite and os.path.exists(fnameout):
+    modcounttotal = 0
+    if args.get('verify_fusion'):
+        with open(fnamein, encoding='utf-8') as infile:
+            data = infile.read()
+        print('Checking whether fusing broad regexes gives the same results on {}...'.format(fnamein))
+        if verify_fusion(regexes, data, record_marker):
+            print('Done. Fusing gives exactly the same results.')
+        else:
+            print('Done. Fusing DOES NOT give the same results (please report this as a bug). Run without -f.')
+        return
+    aborted = not overwrite and os.path.exists(fnameout)
+    if aborted:
         print("Output file already exists! Aborted.")
         t = RoughTimer()
+    elif args.get('stream'):
+        import SFMTools as sfm  #needed for finding record boundaries, even if all regexes are broad
+        t = RoughTimer()
+        print("Applying {} regular expressions, streaming from one file to the other...".format(len(regexes)))
+        for i, regex in enumerate(regexes):
+            msg = ascii('applying regex {} of {}: \n    {}\n    {}'.format(i+1, len(regexes), regex._findstr, regex._replace))
+            print('Narrowly' if regex.narrow else 'Broadly', msg)
+            if not regex.narrow and not regex.record_local:
+                print("  WARNING: this broad regex isn't marked as record-local, so it will need the whole file in memory.")
+        with open(fnamein, encoding='utf-8') as infile, open_output(fnamein, fnameout, record_marker, args.get('delta')) as outfile:
+            counts = apply_streaming(regexes, infile, outfile, record_marker, fuse=fuse)
+        for i, modcount in enumerate(counts):
+            print('  regex {} made {} changes{}'.format(i+1, modcount, skip_note(regexes[i])))
+            modcounttotal += modcount
     else:
         with open(fnamein, encoding='utf-8') as infile:
             data = infile.read() #read the whole data file into memory (even though SFMTools doesn't require this)
@@ -270,42 +1174,47 @@ def execute(args):
                 raise Exception('Aborted.')
                 
         i=0
-        modcounttotal = 0
-        for regex in regexes:
-            i+=1
-            modcount = 0 
+        workers = args.get('workers') or 1
+        executor = ProcessPoolExecutor(workers) if workers > 1 and some_narrow and not args.get('cache') else None
+        cache = RecordCache(fnamein + CACHE_EXT) if args.get('cache') else None
+        pieces = split_pieces([data], record_marker) if cache else None  #(with a cache, the regexes are applied record by record)
+        # Any consecutive narrow regexes are grouped, so they can share a single parse of the data
+        for group in group_regexes(regexes, fuse):
             print('  just took: {}'.format(t.just_elapsed()))
-            #msg = 'applying regex {} of {}'.format(i, len(regexes))
-            msg = 'applying regex {} of {}: \n    {}\n    {}'.format(i, len(regexes), regex._findstr, regex._replace)
-            msg = ascii(msg)
-            data_out = io.StringIO('') #initialize an empty stream object
-
-            if not regex.narrow:
-                print('Broadly', msg)
-                data, count = regex.apply(data)
-                modcount += count
+            for regex in group:
+                i+=1
+                #msg = 'applying regex {} of {}'.format(i, len(regexes))
+                msg = 'applying regex {} of {}: \n    {}\n    {}'.format(i, len(regexes), regex._findstr, regex._replace)
+                msg = ascii(msg)
+                print('Narrowly' if regex.narrow else 'Broadly', msg)
+            if len(group) > 1 and not group[0].narrow:
+                print('  (these {} broad regexes are independent, so they are fused into a single pass)'.format(len(group)))
 
+            if cache is not None:
+                pieces, counts = _apply_step_cached(group, pieces, record_marker, cache)
+            elif not group[0].narrow:
+                data, counts = apply_broad(group, data)
             else:
-            #TODO: POOR PERFORMANCE! the section below needs to be optimized, probably in the apply_narrowly() code
-            # It seems inefficient to process the header and parse the file into a list every time, but that seems necessary.
-            # (Regexes could change record boundaries, delete records, etc., so it's better to reload.) And I doubt that's
-            # the main problem, since the script is slow even when only a single (narrow) regex is applied.
-                print('Narrowly', msg)
-                sfm_records = sfm.SFMRecordReader(data, record_marker)
-                data_out.write(sfm_records.header) 
-                for sfm_record in sfm_records:
-                    L = sfm_record.as_lists() #returns a pointer to a MODIFIABLE list object 
-                    L, count = regex.apply_narrowly(L) #modifies the list
-                    modcount += count
-                    #TODO: Consider caching the following as it is, if the next regex is 'narrow' too, so as to not have to reparse the SFM file/string
-                    data_out.write(sfm_record.as_string()) 
-                    data = data_out.getvalue() 
-            print('  made {} changes'.format(modcount))
-
-            modcounttotal += modcount
+                # Each record goes through the whole group before being written out. (Regexes could change record
+                # boundaries, delete records, etc., but apply_narrow_chain re-parses wherever that matters.)
+                if executor:
+                    data, counts = apply_narrow_parallel(executor, group, data, record_marker, workers * 4)
+                else:
+                    data, counts = apply_narrow_chain(group, data, record_marker)
+            for regex, modcount in zip(group, counts):
+                print('  made {} changes{}'.format(modcount, skip_note(regex)))
+                modcounttotal += modcount
+        if executor:
+            executor.shutdown()
+        if cache is not None:
+            data = ''.join(pieces)
+            cache.save()
+            print('Reused the cached results of {} of {} record steps (cache: {})'.format(cache.hits, cache.hits + cache.misses, cache.fname))
 
-        with open(fnameout, mode='w', encoding='utf-8') as outfile:
+        with open_output(fnamein, fnameout, record_marker, args.get('delta')) as outfile:
                 outfile.write(data)
+    if args.get('profile') and not aborted:
+        write_profile(regexes, fnameout, perf_counter() - started)
     print('just took: {}'.format(t.just_elapsed()))
     print("Done. A total of {} modifications were made".format(modcounttotal))
 
@@ -0,0 +1,106 @@
+#! /usr/bin/python3
+
+'''This Python 3.x script measures how quickly ApplyRE applies sets of regular expressions to SFM lexicons of
+various sizes, so that the effect of a change to ApplyRE (or SFMTools) can be measured and tracked over time.
+
+For each lexicon size, it generates a synthetic MDF-style lexicon (see SFMBench.make_lexicon), and for each
+regex file it times these separately:
+- get_regexes: loading and compiling the regex file
+- broad: applying the broad regexes (to the whole data at once)
+- narrow: applying the narrow regexes (including parsing the data into records and writing them back out)
+- parse_serialize: just parsing the data into records and writing them back out, with no regexes (i.e. the
+  part of the narrow time that's overhead)
+The data is held in memory throughout, so reading and writing files isn't included.
+
+The results are printed, and also appended (as one "run") to a JSON file, which therefore builds up a history.
+By default, the regex files shipped with ApplyRE are used: ApplyRE.regex.txt (all broad) and
+lexicon-sample-regex.txt (mostly narrow).
+
+Sample command-line calls (the first just displays help):
+python ApplyREBench.py -h
+python ApplyREBench.py
+python ApplyREBench.py -n 10000 100000 -r myrules.txt -j results.json
+'''
+
+import argparse, gc, json, os, platform, sys, time
+
+import ApplyRE
+import SFMBench
+import SFMTools as sfm
+
+SIZES = (10000, 100000, 1000000)  # default numbers of records
+HERE = os.path.dirname(os.path.abspath(__file__))
+REGEXFILES = (os.path.join(HERE, 'ApplyRE.regex.txt'), os.path.join(HERE, 'lexicon-sample-regex.txt'))
+JSONFILE = 'ApplyREBench.json'
+REPEAT = 20  # get_regexes is fast, so it's timed this many times and averaged
+
+def get_args():
+    ''' Parse any command line arguments (all are optional). '''
+    parser = argparse.ArgumentParser(description='Measure how quickly ApplyRE applies regexes to lexicons of various sizes.')
+    parser.add_argument('-n', '--counts', type=int, nargs='+', default=list(SIZES),
+                        help='the numbers of records to generate (default: {})'.format(' '.join(str(n) for n in SIZES)))
+    parser.add_argument('-r', '--regexfile', action='append',
+                        help='a regex file to measure (can be given more than once; default: the shipped ones)')
+    parser.add_argument('-j', '--json', default=JSONFILE, help='the JSON file to add the results to (default: {})'.format(JSONFILE))
+    return vars(parser.parse_args())
+
+def time_get_regexes(fname, repeat=REPEAT):
+    ''' Return the average number of seconds get_regexes takes to load the regex file. '''
+    start = time.perf_counter()
+    for _ in range(repeat):
+        ApplyRE.get_regexes(fname)
+    return (time.perf_counter() - start) / repeat
+
+def time_parse_serialize(data, record_marker):
+    ''' Return the seconds taken to parse the data into records and write them back out as a string. '''
+    gc.collect()
+    start = time.perf_counter()
+    records = sfm.SFMRecordReader(data, record_marker)
+    ''.join([records.header] + [record.as_string() for record in records])
+    return time.perf_counter() - start
+
+def time_regexes(fname, data):
+    ''' Apply the regexes in the file to the data, as ApplyRE.execute does. Return a dictionary of timings (in
+    seconds) and counts. '''
+    record_marker, regexes = ApplyRE.get_regexes(fname)
+    result = {'broad_regexes': 0, 'narrow_regexes': 0, 'broad': 0.0, 'narrow': 0.0, 'modifications': 0}
+    gc.collect()
+    for group in ApplyRE.group_regexes(regexes):
+        kind = 'narrow' if group[0].narrow else 'broad'
+        start = time.perf_counter()
+        if group[0].narrow:
+            data, counts = ApplyRE.apply_narrow_chain(group, data, record_marker)
+        else:
+            data, counts = ApplyRE.apply_broad(group, data)
+        result[kind] += time.perf_counter() - start
+        result[kind + '_regexes'] += len(group)
+        result['modifications'] += sum(counts)
+    result['parse_serialize'] = time_parse_serialize(data, record_marker) if result['narrow_regexes'] else 0.0
+    return result
+
+def execute(args):
+    fnames = args['regexfile'] or list(REGEXFILES)
+    run = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': sys.version.split()[0], 'platform': platform.platform(), 'results': []}
+    print('{:<28} {:>9} {:>8} {:>12} {:>9} {:>9} {:>10}'.format('regex file', 'records', 'MB', 'get_regexes', 'broad', 'narrow', 'parse+ser'))
+    for count in args['counts']:
+        data = SFMBench.make_lexicon(count)
+        for fname in fnames:
+            result = {'regexfile': os.path.basename(fname), 'records': count, 'characters': len(data),
+                      'get_regexes': time_get_regexes(fname)}
+            result.update(time_regexes(fname, data))
+            run['results'].append(result)
+            print('{:<28} {:>9} {:>8.1f} {:>12.4f} {:>9.2f} {:>9.2f} {:>10.2f}'.format(result['regexfile'], count, len(data) / 1e6,
+                  result['get_regexes'], result['broad'], result['narrow'], result['parse_serialize']))
+        del data
+    history = {'runs': []}
+    if os.path.exists(args['json']):
+        with open(args['json'], encoding='utf-8') as infile:
+            history = json.load(infile)
+    history['runs'].append(run)
+    with open(args['json'], mode='w', encoding='utf-8') as outfile:
+        json.dump(history, outfile, indent=1)
+    print('Added the results to {}'.format(args['json']))
+
+if __name__ == '__main__':
+    args = get_args() #get args as a dictionary
+    execute(args)
@@ -0,0 +1,145 @@
+#! /usr/bin/python3
+
+'''This Python 3.x script measures how quickly SFMTools can load an SFM lexicon into memory, and how much
+memory the loaded records take. It's meant for comparing the reader and record classes, and for checking
+that a change to SFMTools hasn't made parsing slower or hungrier. With -w, it also times the parallel reader
+with 1, 2, 4, ... worker processes (up to the number given), to show how it scales.
+
+By default it generates a synthetic MDF-style lexicon (any size you like) in a temporary file. Or, you can
+give it a real file. Each reader then loads the whole file (as SFMTools.execute does, via list()), and the
+elapsed time and retained memory per record are reported.
+
+Sample command-line calls (the first just displays help):
+python SFMBench.py -h
+python SFMBench.py -n 200000
+python SFMBench.py mylexicon.txt
+python SFMBench.py -n 1000000 -w 16
+'''
+
+import argparse, gc, os, random, tempfile, time, tracemalloc
+
+import SFMTools as sfm
+
+COUNT = 100000  # default number of records to generate
+
+WORDS = ('aba', 'kotu', 'xemi', 'lapa', 'tinu', 'moxa', 'seba', 'ruka', 'ñaku', 'ŋoro', 'béla')
+GLOSSES = ('dog', 'walk', 'big thing', 'red', 'to carry on the head', 'river')
+PARTS = ('n', 'v', 'adj', 'adv', 'prt')
+
+def get_args():
+    ''' Parse any command line arguments (all are optional). '''
+    parser = argparse.ArgumentParser(description='Measure the speed and memory use of the SFMTools readers.')
+    parser.add_argument('infile', nargs='?', help='an SFM file to load (default: generate a synthetic lexicon)')
+    parser.add_argument('-n', '--count', type=int, default=COUNT, help='how many records to generate (default: {})'.format(COUNT))
+    parser.add_argument('-w', '--workers', type=int, default=0, help='also time SFMParallelRecordReader with up to this many workers')
+    return vars(parser.parse_args())
+
+def make_lexicon(count, seed=1):
+    ''' Return a string containing a synthetic MDF lexicon with the specified number of records.
+
+    The records are random but repeatable (for a given seed), and include the things the tools care about:
+    headers, homograph numbers, multiple ps/sn per entry, subentries, links, wrapped lines and non-ASCII text.'''
+    r = random.Random(seed)
+    out = ['\\_sh v3.0  400  MDF 4.0\n', '\\_DateStampHasFourDigitYear\n', '\n']
+    for i in range(count):
+        word = r.choice(WORDS) + str(i)
+        out.append('\\lx {}\n'.format(word))
+        if r.random() < 0.1:
+            out.append('\\hm {}\n'.format(r.randint(1, 3)))
+        for sense in range(r.randint(1, 3)):
+            out.append('\\ps {}\n'.format(r.choice(PARTS)))
+            out.append('\\sn {}\n'.format(sense + 1))
+            out.append('\\ge {}\n'.format(r.choice(GLOSSES)))
+            out.append('\\de This is a long-winded\nmulti-line definition of {}.\n'.format(word))
+            if r.random() < 0.3:
+                out.append('\\cf {}{}\n'.format(r.choice(WORDS), r.randint(0, count)))
+            if r.random() < 0.2:
+                out.append('\\va {}{}\n'.format(r.choice(WORDS), r.randint(0, count)))
+        if r.random() < 0.2:
+            out.append('\\se {} {}\n\\ge {}\n'.format(word, r.choice(WORDS), r.choice(GLOSSES)))
+        out.append('\\dt 01/Jan/2013\n\n')
+    return ''.join(out)
+
+def measure(load):
+    ''' Call load() twice: once to time it, and once (more slowly) to measure the memory retained by what it returns.
+
+    Return the elapsed seconds, the number of records loaded, and the bytes retained.'''
+    gc.collect()
+    start = time.perf_counter()
+    recs = load()
+    elapsed = time.perf_counter() - start
+    count = len(recs)
+    del recs
+    gc.collect()
+    tracemalloc.start()
+    recs = load()
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del recs
+    return elapsed, count, retained
+
+def loaders(fname):
+    ''' Return a list of (label, function) pairs; each function loads the whole file as a list of records. '''
+    def load(make_reader, touch=False, mode='r'):
+        def f():
+            with open(fname, mode, encoding=None if 'b' in mode else 'utf-8') as infile:
+                recs = list(make_reader(infile))
+            if touch:
+                for rec in recs:
+                    rec.as_lists()
+            return recs
+        return f
+    return [
+        ('SFMRecordReader (line by line)', load(sfm.SFMRecordReader)),
+        ('SFMRecordReader (one buffer)', load(lambda f: sfm.SFMRecordReader(f, field_reader=sfm.SFMBufferReader))),
+        ('SFMLazyRecordReader (views of one buffer)', load(sfm.SFMLazyRecordReader)),
+        ('SFMLazyRecordReader compact', load(lambda f: sfm.SFMLazyRecordReader(f, compact=True))),
+        ('SFMLazyRecordReader compact, all as_lists()', load(lambda f: sfm.SFMLazyRecordReader(f, compact=True), True)),
+        ('SFMBytesRecordReader (undecoded UTF-8)', load(sfm.SFMBytesRecordReader, mode='rb')),
+        ('SFMBytesRecordReader compact', load(lambda f: sfm.SFMBytesRecordReader(f, compact=True), mode='rb')),
+    ]
+
+def scaling(fname, max_workers):
+    ''' Time SFMParallelRecordReader loading the whole file with 1, 2, 4, ... workers. Return a list of
+    (workers, seconds) pairs. '''
+    counts = [1]
+    while counts[-1] * 2 < max_workers:
+        counts.append(counts[-1] * 2)
+    if max_workers > 1: counts.append(max_workers)
+    times = []
+    for workers in counts:
+        gc.collect()
+        start = time.perf_counter()
+        recs = list(sfm.SFMParallelRecordReader(fname, workers=workers))
+        times.append((workers, time.perf_counter() - start))
+        del recs
+    return times
+
+def execute(args):
+    fname = args['infile']
+    tmp = None
+    if not fname:
+        print('Generating a synthetic lexicon of {} records...'.format(args['count']))
+        tmp = tempfile.NamedTemporaryFile(mode='w', encoding='utf-8', suffix='.txt', delete=False)
+        with tmp:
+            tmp.write(make_lexicon(args['count']))
+        fname = tmp.name
+    try:
+        print('File size: {:.1f} MB'.format(os.path.getsize(fname) / 1e6))
+        print('{:<45} {:>9} {:>9} {:>12} {:>10}'.format('reader', 'records', 'seconds', 'retained MB', 'B/record'))
+        for label, load in loaders(fname):
+            elapsed, count, retained = measure(load)
+            print('{:<45} {:>9} {:>9.2f} {:>12.1f} {:>10.0f}'.format(label, count, elapsed, retained / 1e6, retained / max(count, 1)))
+        if args['workers']:
+            print('\n{:<45} {:>9} {:>9}'.format('SFMParallelRecordReader', 'seconds', 'speedup'))
+            times = scaling(fname, args['workers'])
+            for workers, elapsed in times:
+                print('{:<45} {:>9.2f} {:>8.1f}x'.format('{} worker(s)'.format(workers), elapsed, times[0][1] / elapsed))
+    finally:
+        if tmp:
+            os.remove(fname)
+
+if __name__ == '__main__':
+    args = get_args() #get args as a dictionary
+    execute(args)
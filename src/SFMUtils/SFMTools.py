@@ -20,6 +20,9 @@ http://linguisticsoftware.wordpress.com/2012/11/23/running-python-scripts-conven
 Sample command-line calls (the first just displays help; the second specifies an input file):
 python SFMTools.py -h
 python SFMTools.py input.txt
+python SFMTools.py input.txt -s -w 4    (just the stats, compiled by 4 worker processes)
+python SFMTools.py input.txt -c    (just the non-ASCII characters, listed for each field; -f adds that list to the full report)
+python SFMTools.py input.txt -i
 
 In Windows, use the py launcher instead; you may want to create a batch file that you can easily double-click to run this. But don't name it SFMTools.bat
 - Example 1:
@@ -31,26 +34,35 @@ pause
 
 '''
 
-import re, io, argparse
+import re, io, os, argparse, mmap, shutil, json, hashlib, sqlite3
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 
 import sys
 print("Running under Python {}".format(sys.version.split()[0]))
 #print("sys.path : {}".format(sys.path))
-from collections import defaultdict
+from collections import defaultdict, deque, Counter, namedtuple
 import unicodedata
+try:
+    import numpy  # optional; speeds up counting the characters in a large lexicon
+except ImportError:
+    numpy = None
 
 # import nltk_contrib #TODO: use or remove this
 
 
 # Constants:
 HEADER_TAG = '\\_'
-BOM = 62579
+BOM = 65279  # U+FEFF
 RECORD_MARKER = 'lx'
 
 DEFAULT_FILE = 'lexicon.txt' # note: folders in file paths should use forward slashes; or, double backslashes work too, on Windows.
 OUTFILE_EXT = '.report.txt'
 TALLY_FIELDS = ('ps', 'pn', 'lf', 'sn')
 ENTRY_FIELDS = ('lx', 'se',)
+CITATION_FIELDS = ('lc', 'lse')
 VARIANT_LINK_FIELDS = ('va', 'vase', 'vasn', 'valx', 'vaN', 'vaNS', 'vaNSW', 'vaNW', 'vaS', 'vaSW', 'vaW')
 LINK_FIELDS = ('cf', 'cflx', 'lxS', 'lxW',  'cfse', 'cfsn', 'sy', 'mn', 'mnse', 'mnva', 'an', 'lv', )  # fields whose target entries ought to exist (not necessarily true of va)
 #LINK_FIELDS += ('va', 'vase', 'vasn')
@@ -59,6 +71,11 @@ LINK_FIELDS += ('cfcpx', 'cfroot')
 PS = 'ps'
 SN = 'sn'
 HM = 'hm'
+DELTA_HEADER = 'SFM delta v1'
+DELTA_WINDOW = 64  # how many records ahead SFMDeltaWriter looks, to match up the new records with the original ones
+INDEX_EXT = '.index.sqlite'  # open_lexicon_index saves a file's index next to it, with this appended to its name
+INDEX_VERSION = 1  # (increment this if the format of the saved index changes)
+INDEX_MIN_FIELDS = 40  # records with fewer fields than this are just scanned, since building a marker index wouldn't pay off
 
 # To temporarily override the above constants, copy them below and tweak them
 TALLY_FIELDS = ('ps', 'pn', 'lf', 'sn', 'hm', 'pdl', 'un', 'unsn', 'bw', 'es', 'dl', 'vn')
@@ -69,6 +86,11 @@ def get_args():
     parser = argparse.ArgumentParser(description='Parse and analyze an SFM file. For more info, open the .py file in a text editor and read the comments.')
     parser.add_argument('infile', default=DEFAULT_FILE, nargs='?', help='the input file (default: {})'.format(DEFAULT_FILE))
     parser.add_argument('outfile', nargs='?', help='the output file to save to (default: infile plus {})'.format(OUTFILE_EXT))
+    parser.add_argument('-c', '--chars', action='store_true', help='just report the non-ASCII characters found in each field (quick)')
+    parser.add_argument('-i', '--index', action='store_true', help='check links using an index saved next to the input file (built or updated as needed; see open_lexicon_index)')
+    parser.add_argument('-f', '--chars-by-field', action='store_true', help='in the stats, also list the non-ASCII characters found in each field (as -c does)')
+    parser.add_argument('-s', '--stats', action='store_true', help='just report the stats (skipping the link and sense number checks)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='with -s, compile the stats with this many worker processes (default: 1; 0 means one per core)')
     return vars(parser.parse_args())
 
 def ascii(s):
@@ -102,6 +124,38 @@ def bad_encoding(filename, enc='utf-8', max=9):
 
     return errors
 
+def decode_checked(data, errors='strict', max_errors=9):
+    '''Decode UTF-8 bytes, noting where any invalid sequences are, in the same pass. Return the text, and a list of (line number, byte offset) pairs for up to max_errors
+    of the invalid sequences (an empty list if there were none).
+
+    If errors is 'strict', raise a UnicodeDecodeError once max_errors problems have been found (or at the
+    end); its message lists them all. If errors is 'replace', each invalid sequence becomes U+FFFD.
+    '''
+    view = memoryview(data)  #(so the pieces between errors can be decoded without copying them first)
+    pieces, found = [], []
+    pos, line, line_pos = 0, 1, 0
+    while True:
+        try:
+            pieces.append(str(view[pos:], 'utf-8'))
+            break
+        except UnicodeDecodeError as e:
+            start, end = pos + e.start, pos + e.end
+            if not found:
+                first = (start, end)
+            line += data.count(b'\n', line_pos, start)
+            line_pos = start
+            found.append((line, start))
+            if len(found) >= max_errors:
+                if errors == 'strict': break
+                pieces += [str(view[pos:start], 'utf-8'), '\ufffd', str(view[end:], 'utf-8', errors)]  #stop noting errors
+                break
+            pieces += [str(view[pos:start], 'utf-8'), '\ufffd']
+            pos = end
+    if found and errors == 'strict':
+        raise UnicodeDecodeError('utf-8', data, first[0], first[1], 'invalid UTF-8 at ' +
+            ', '.join('line {} (byte {})'.format(*f) for f in found))
+    return ''.join(pieces), found
+
 
 def break_field(field):
     ''' Take a string and break it into its marker and data (i.e. into a list of two strings).
@@ -119,62 +173,160 @@ def break_field(field):
     '''
 
     if not field.startswith("\\"): raise ValueError("string must begin with \\")
-
-    pos = -1
-#    tmp = field.find("\n")
-#    if (tmp != -1) and (tmp < len(field)):
-#        pos = tmp
-    tmp = field.find(" ")
-    if (tmp != -1):
-        pos = tmp
+    pos = field.find(" ")
+    if pos != -1: #the line has at least one space; break on it and omit it
+        if pos < 2: raise ValueError("field marker must come before any spaces")
+        return [field[1:pos], field[pos + 1:]]
+    #no space found; break at the first newline (same as break_pos, but inlined, since this is called once per field)
+    nlpos = field.find("\n")
+    if nlpos == -1: nlpos = len(field)
+    return [field[1:nlpos], field[nlpos:]]
+
+def break_pos(text, start=0, end=None):
+    ''' Find where break_field would break the field found at text[start:end], without copying it out first.
+
+    Return two offsets into text: where the marker ends, and where the data begins. (They differ by one when
+    the marker is followed by a space, since that space is omitted.) text can also be UTF-8 bytes.
+    '''
+    if end is None: end = len(text)
+    space, newline = (b" ", b"\n") if isinstance(text, bytes) else (" ", "\n")
+    pos = text.find(space, start, end)
+    if pos != -1: #the line has at least one space; break on it and omit it
+        if pos - start < 2: raise ValueError("field marker must come before any spaces")
+        return pos, pos + 1
+    #no space found; break at the first newline. (Default assumption: it's all marker and no data.)
+    nlpos = text.find(newline, start, end)
+    if nlpos == -1: nlpos = end
+    return nlpos, nlpos
+
+def round_trips(text):
+    ''' Return True if the given record text is exactly what SFMRecord.as_string() would rebuild from it once parsed.
     
-    if pos < 2 and pos != -1 : raise ValueError("field marker must come before any spaces")
-
-
-    breakat = len(field) #default assumption: it's all marker and no data
-    if pos != -1 : #the line has at least one space; break on it and omit it
-        breakat = pos
-        data = field[breakat + 1:]
-    else:           
-        #no space found
-        nlpos = field.find("\n")
-        if nlpos != -1: breakat = nlpos #break at the first newline
-        data = field[breakat:]
-
-    marker = field[1:breakat]
-    return [marker, data]
+    (It's conservative. The rebuilt string omits a space that directly follows a marker and precedes a newline,
+    and adds a space where a field has neither; so any text containing ' \\n' or lacking a final newline fails.)'''
+    return text.endswith('\n') and ' \n' not in text
 
 def split_list(alist, indices):
     ''' Given a list and a list of indexes/indices, split the list at those locations to return a list of lists. '''
     return [alist[i:j] for i, j in zip([0]+indices, indices+[None])]
 
+class MarkerTable:
+    ''' Interns SFM markers, giving each distinct marker a small integer ID (in order of first appearance).
+
+    Each reader has one of these (as its markers attribute), so that all the fields sharing a marker such as
+    lx or ge share one string object, and so that records can store and compare their markers as integers.
+    '''
+
+    def __init__(self):
+        self.names = []  # index = ID; val = marker
+        self.ids = {}  # key = marker; val = ID
+        self.shared = {}  # key = marker; val = the table's own copy of it (for a quick lookup when parsing)
+
+    def intern(self, mkr):
+        ''' Return the ID for this marker, adding the marker to the table if it's new. '''
+        try:
+            return self.ids[mkr]
+        except KeyError:
+            mkr = sys.intern(mkr)
+            self.ids[mkr] = len(self.names)
+            self.shared[mkr] = mkr
+            self.names.append(mkr)
+            return self.ids[mkr]
+
+    def name(self, mkr):
+        ''' Return the table's own (shared) copy of this marker string. '''
+        return self.names[self.intern(mkr)]
+
+    def marker_set(self, markers):
+        ''' Return a MarkerSet for the given list/tuple of markers. (A single string is treated as one marker.) '''
+        if isinstance(markers, MarkerSet) and markers.table is self:
+            return markers
+        return MarkerSet(self, markers)
+
+class MarkerSet(frozenset):
+    ''' A set of markers that can be tested either by name ('ps' in s) or by ID (table.intern('ps') in s).
+
+    It holds both the names and their IDs from one MarkerTable, so either test is a single hash lookup.
+    The find methods of SFMRecord accept one of these wherever they accept a list of markers; records from
+    the same reader then compare their markers' IDs rather than the marker strings.
+    '''
+    __slots__ = ('table',)
+
+    def __new__(cls, table, markers):
+        if isinstance(markers, str): markers = [markers]
+        names = [m for m in markers if isinstance(m, str)]
+        obj = frozenset.__new__(cls, names + [table.intern(m) for m in names])
+        obj.table = table
+        return obj
+
+    def names(self):
+        ''' Return just the markers (not their IDs). '''
+        return [m for m in self if isinstance(m, str)]
+
+class FieldList(list):
+    ''' The list of fields that an SFMRecord keeps (and hands out via as_lists()). It's an ordinary list, except
+    that it counts how many times it has been modified, so that the record can tell whether its marker index
+    is still current.
+    Limitation: editing a field in place (e.g. field[0] += 'va') isn't counted; call the record's changed() method after doing that.
+    '''
+    __slots__ = ('version',)
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self.version = 0
+
+def _counted(name):
+    ''' Wrap one of list's modifying methods so that it increments the version. '''
+    method = getattr(list, name)
+    def counted(self, *args):
+        self.version += 1
+        return method(self, *args)
+    counted.__name__ = name
+    return counted
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse'):
+    if hasattr(list, _name):
+        setattr(FieldList, _name, _counted(_name))
+
 class SFMRecord:
     ''' Represents a single record from an SFM file. This is passed in as a list of strings and can be retrieved in two ways:
     - as a list of fields, in which each field is itself a two-value list (marker and content)
     - as a single (multi-line) string
     '''
-    
-    def __init__(self, rec_lines=None, cursor=None):
+    __slots__ = ('location', '_fields_split', '_table', '_index', '_source', '_clean', '__dict__')  # (__dict__ is only allocated if a script adds its own attributes)
+
+    def __init__(self, rec_lines=None, cursor=None, markers=None):
         ''' Given a list of lines of text, parse them into the lines of an SFM record object
         
-        Optionally, the file location can be specified (mainly for reporting).'''
+        Optionally, the file location can be specified (mainly for reporting), as can a MarkerTable
+        for interning the markers (normally the reader's).
+        The original text is kept, so that as_string() can simply return it if the record is never modified.'''
 
         self.location = cursor
+        self._table = markers
+        self._index = None
+        self._source = rec_lines or None  # joined (and checked) the first time as_string() needs it
         brokenfields = []
         if rec_lines:
+            shared = markers.shared if markers is not None else None
             for field in rec_lines:
                 br = break_field(field)
+                if shared is not None:
+                    br[0] = shared.get(br[0]) or markers.name(br[0])
 #                if isinstance(field, str):
 #                    #TODO: ?? maybe use hasattr instead, checking for the existence of the startswith() method
 #                    br = break_field(field)
 #                else: #assume it's already the right kind of list
 #                    br = field
                 brokenfields.append(br)
-        self._fields_split = brokenfields
+        self._fields_split = FieldList(brokenfields)
+        self._clean = 0  # the FieldList version that matches _source (None once the fields may have been modified)
 
     @classmethod
     def from_lists(cls, the_lists, cursor=None):
-        ''' An alternate constructor that starts from already-parsed data '''
+        ''' An alternate constructor that starts from already-parsed data.
+
+        (If the_lists is a plain list rather than a FieldList, find() can't use a marker index for this record.)'''
         obj = cls(cursor=cursor)
         obj._fields_split = the_lists
         return obj
@@ -183,20 +335,121 @@ class SFMRecord:
         ''' Return the record as a list of fields. (Each list is itself a two-value list: marker, value.) 
         
         Note that the calling code can modify that list's contents as it pleases prior to calling the as_string() method.
+        (Since those edits can't all be detected, as_string() will then always rebuild the string. To just read
+        the fields, use fields() or field() instead.)
         '''
+        fields = self._lists()
+        self._clean = None
+        self._index = None  # (the caller may rename markers in place, which the marker index can't detect)
+        return fields
+
+    def _lists(self):
+        ''' Return the list of fields, for use within this class (i.e. without giving up the cached string). '''
         return self._fields_split
+
+    def fields(self):
+        ''' Return a read-only copy of the record's fields, as a list of (marker, value) tuples. '''
+        return [tuple(field) for field in self._lists()]
+
+    def field(self, i):
+        ''' Return the i'th field as a (marker, value) tuple. '''
+        return tuple(self._lists()[i])
+
+    def line_number(self, i):
+        ''' Return the number of the line where the i'th field begins (or None if the record's location is unknown).
+        This is exact unless fields before it have been changed since the record was read. '''
+        if self.location is None: return None
+        return self.location + sum(mkr.count('\n') + value.count('\n') for mkr, value in self._lists()[:i])
+
+    def set_value(self, i, value):
+        ''' Replace the data portion of the i'th field. '''
+        fields = self._lists()
+        fields[i] = [fields[i][0], value]
+
+    def is_modified(self):
+        ''' Return True if the record may have been modified (so as_string() must rebuild it) since it was read. '''
+        if self._clean is None or self._clean != getattr(self._fields_split, 'version', None):
+            return True
+        if self._source is not None and not isinstance(self._source, str):  # the original lines, not yet joined
+            text = ''.join(self._source)
+            self._source = text if round_trips(text) else None
+        return self._source is None
+
+    def marker_table(self):
+        ''' Return the MarkerTable this record's markers are interned in, creating one if it has none. '''
+        if self._table is None:
+            self._table = MarkerTable()
+        return self._table
+
+    def marker_ids(self):
+        ''' Return an array of the IDs of this record's markers (see MarkerTable), in order. '''
+        table = self.marker_table()
+        return array('I', [table.intern(field[0]) for field in self._fields_split])
+
+    def changed(self):
+        ''' Tell the record that one of its fields was modified in place (e.g. a marker was renamed via the list
+        that as_lists() returned), so that it will discard anything it has cached about its fields. '''
+        self._index = None
+        self._clean = None
+
+    def _marker_index(self):
+        ''' Return a dict mapping each marker in the record to a sorted list of its positions, building it on first use
+        and rebuilding it whenever the field list has been modified. Return None if modifications can't be detected,
+        or if the record is small enough that a plain scan is faster.'''
+        fields = self._fields_split
+        if not isinstance(fields, FieldList) or len(fields) < INDEX_MIN_FIELDS:
+            return None
+        index = self._index
+        if index is None or index[0] != fields.version:
+            positions = {}
+            for i, field in enumerate(fields):
+                positions.setdefault(field[0], []).append(i)
+            self._index = index = (fields.version, positions)
+        return index[1]
+
+    def _find_indexed(self, index, targets, start, bounds):
+        ''' Answer find() from a marker index, using bisect on the positions of only those markers that are targets or bounds.'''
+        hits, stop = [], None
+        for mkr, positions in index.items():
+            if mkr in targets:
+                hits.append((mkr, positions))
+            elif bounds and mkr in bounds:  # the first bounding marker at or after start
+                j = bisect_left(positions, start)
+                if j < len(positions) and (stop is None or positions[j] < stop):
+                    stop = positions[j]
+        sns = []
+        for mkr, positions in hits:
+            j = bisect_left(positions, start)
+            k = len(positions) if stop is None else bisect_left(positions, stop)
+            sns.extend([(mkr, i) for i in positions[j:k]])
+        if len(hits) > 1:
+            sns.sort(key=lambda x: x[1])
+        return sns
+
+    def _index_is_stale(self, sns):
+        ''' Spot-check found positions against the fields themselves, in case a marker was renamed in place without a call to changed(). '''
+        fields = self._fields_split
+        for mkr, i in sns:
+            if fields[i][0] != mkr:
+                self._index = None
+                return True
+        return False
     
     def as_string(self):
         ''' Take a broken-down record and piece it back together as a single string.
+
+        If the record hasn't been modified since it was read, this just returns the original text.
         '''
-#        return join_as_str(self._fields_split)
-        tmp = ''
-        for field in self._fields_split:
+        if not self.is_modified():
+            return self._source
+        tmp = []
+        for field in self._lists():
             #join everything back into a string
-            tmp += '\\' + field[0]
-            if not field[1].startswith('\n'): tmp += ' ' #put back the space between the marker and its data
-            tmp += field[1]
-        return tmp
+            tmp.append('\\')
+            tmp.append(field[0])
+            if not field[1].startswith('\n'): tmp.append(' ') #put back the space between the marker and its data
+            tmp.append(field[1])
+        return ''.join(tmp)
 
     
     def split(self, markers):
@@ -210,7 +463,7 @@ class SFMRecord:
             # split into multiple new SFMRecord objects
             recs = []
             indexes = [x[1] for x in matches]  # we just need a list of indexes
-            chunks = split_list(self.as_lists(), indexes)
+            chunks = split_list(self.as_lists(), indexes)  # (the new records share their fields with this one)
             for chunk in chunks:
                 r = SFMRecord.from_lists(chunk, cursor=self.location) # create a new SFMRecord
                 recs.append(r)
@@ -223,11 +476,23 @@ class SFMRecord:
         ''' Return the first occurrence of any of the target fields in the record, or None if not found.
         '''
         if not targets: return None
+        index = self._marker_index()
+        if index is not None:
+            first = None
+            for mkr, positions in index.items():
+                if mkr in targets and (first is None or positions[0] < first[1]):
+                    first = (mkr, positions[0])
+            if first is None:
+                return None
+            if not self._index_is_stale([first]):
+                self._clean = None  # (the caller may modify the field we return)
+                return self._fields_split[first[1]]
         ret = None
         i = 0
-        for field in self.as_lists():
+        for field in self._lists():
             mkr = field[0]
             if mkr in targets:
+                self._clean = None  # (the caller may modify the field we return)
                 ret = field
                 break
             i += 1
@@ -238,8 +503,14 @@ class SFMRecord:
         ''' Find all occurrences of the desired marker(s) at or after the start index but before any bounding markers.
         
         Return a list of tuples, where each tuple is a marker and an index.
+        Uses the record's marker index (built on first use) when it can, rather than scanning every field.
         '''
-        rec = self.as_lists()
+        index = self._marker_index()
+        if index is not None:
+            sns = self._find_indexed(index, targets, start, bounds)
+            if not self._index_is_stale(sns):
+                return sns
+        rec = self._lists()
         i = start
         sns = []
         while i < len(rec):
@@ -256,7 +527,7 @@ class SFMRecord:
         ''' Do a find but just return the values (no indexes, and stripped)
         '''
         sns = self.find(targets, start, bounds)
-        L = self.as_lists()
+        L = self._lists()
         return [L[v][1].strip() for _m,v in sns]
 
     def insert_field_between(self, first, second, insert_this):
@@ -267,7 +538,7 @@ class SFMRecord:
         For example, the following inserts a blank sn field between ps and ge, or between pn and ge, etc.
           count = rec.insert_field_between( ('ps','pn'), ('ge','de'), ('sn', '\n') )
         '''
-        fields = self._fields_split
+        fields = self._lists()
 #        found_first = False
         i, insertion_points = 1, []
         
@@ -296,7 +567,7 @@ class SFMRecord:
         # (\\(?!(lx|se)).*)(\r\n)(\\hm\b.*)
         
         hom = None
-        fields = self.as_lists()
+        fields = self._lists()
         mkr, val = fields[i]
         val = val.strip()
         if i+1 < len(fields) and fields[i+1][0] in hm:
@@ -309,6 +580,205 @@ class SFMRecord:
             hom = int(hom)
         return mkr, val, hom
 
+class SFMRecordView(SFMRecord):
+    ''' A lazy SFMRecord that doesn't copy or parse anything up front. It just keeps a reference to the buffer
+    the record was read from (a string holding the whole file) plus the offset where each of its fields begins.
+    
+    Markers and values are sliced out of the buffer only when find(), find_first(), find_values() or split()
+    actually look at them, and as_string() returns the record's original text as a single slice when that is
+    identical to what SFMRecord would rebuild. The first call to as_lists() parses the record into ordinary
+    (modifiable) lists, after which it behaves exactly like an SFMRecord.
+    Note: since parsing is deferred, a malformed field raises its ValueError when it's first looked at.
+
+    A view can also serve as a compact, standalone record: if data is just the record's own text and starts is
+    an array of small integers, each record costs little more than its text. (See SFMLazyRecordReader's compact option.)
+    '''
+    __slots__ = ('_data', '_starts', '_end', '_ids')
+
+    def __init__(self, data, starts, end, cursor=None, markers=None):
+        ''' data is the buffer; starts is a sequence of the offsets where each field begins; end is where the last field ends.
+        markers is the MarkerTable for the record's marker IDs (normally the reader's). '''
+        self.location = cursor
+        self._table = markers
+        self._data = data
+        self._starts = starts
+        self._end = end
+        self._fields_split = None # not parsed yet
+        self._ids = None
+        self._index = None
+        self._source = self._clean = None
+
+    def _bounds(self, i):
+        ''' Return the start and end offsets of field i. '''
+        starts = self._starts
+        return starts[i], (starts[i+1] if i + 1 < len(starts) else self._end)
+
+    def _text(self, start, end):
+        ''' Return the text found between these two offsets in the buffer. '''
+        return self._data[start:end]
+
+    def marker_ids(self):
+        ''' Return an array of the IDs of this record's markers, slicing the markers out of the buffer the first time. '''
+        if self._fields_split is not None:
+            return SFMRecord.marker_ids(self)
+        if self._ids is None:
+            data, table = self._data, self.marker_table()
+            ids = array('I')
+            for i in range(len(self._starts)):
+                start, end = self._bounds(i)
+                ids.append(table.intern(self._text(start+1, break_pos(data, start, end)[0])))
+            self._ids = ids
+        return self._ids
+
+    def _markers(self):
+        ''' Return a list of this record's markers. '''
+        names = self.marker_table().names
+        return [names[x] for x in self.marker_ids()]
+
+    def _marker_index(self):
+        ''' Like SFMRecord._marker_index. (An unparsed view can't be modified, so its index never goes stale.) '''
+        if self._fields_split is not None:
+            return SFMRecord._marker_index(self)
+        if len(self._starts) < INDEX_MIN_FIELDS:
+            return None
+        if self._index is None:
+            positions = {}
+            for i, mkr in enumerate(self._markers()):
+                positions.setdefault(mkr, []).append(i)
+            self._index = (None, positions)
+        return self._index[1]
+
+    def _value(self, i):
+        ''' Return the data portion of field i. '''
+        start, end = self._bounds(i)
+        return self._text(break_pos(self._data, start, end)[1], end)
+
+    def _lists(self):
+        ''' Parse the record into a list of fields (see SFMRecord.as_lists), and stop using the buffer. '''
+        if self._fields_split is None:
+            table = self.marker_table()
+            texts = [self._text(*self._bounds(i)) for i in range(len(self._starts))]
+            fields = [break_field(text) for text in texts]
+            for field in fields:
+                field[0] = table.name(field[0])
+            text = ''.join(texts)
+            self._source = text if round_trips(text) else None
+            self._fields_split = FieldList(fields)
+            self._clean = 0
+            self._data = self._starts = self._ids = self._index = None
+        return self._fields_split
+
+    def field(self, i):
+        ''' Return the i'th field as a (marker, value) tuple, slicing just that field out of the buffer. '''
+        if self._fields_split is not None:
+            return SFMRecord.field(self, i)
+        start, end = self._bounds(i)
+        breakat, datastart = break_pos(self._data, start, end)
+        return self._text(start+1, breakat), self._text(datastart, end)
+
+    def fields(self):
+        ''' Return a read-only copy of the record's fields, as a list of (marker, value) tuples. '''
+        if self._fields_split is not None:
+            return SFMRecord.fields(self)
+        return [self.field(i) for i in range(len(self._starts))]
+
+    def line_number(self, i):
+        if self._fields_split is not None or self.location is None:
+            return SFMRecord.line_number(self, i)
+        newline = b'\n' if isinstance(self._data, bytes) else '\n'
+        return self.location + self._data.count(newline, self._starts[0], self._bounds(i)[0])
+
+    def is_modified(self):
+        if self._fields_split is None:
+            return False
+        return SFMRecord.is_modified(self)
+
+    def as_string(self):
+        ''' Return the record as a single string. If it hasn't been parsed, that's just a slice of the buffer.'''
+        if self._fields_split is not None:
+            return SFMRecord.as_string(self)  # (which returns the original text if the record hasn't been modified)
+        data = self._data
+        text = self._text(self._starts[0], self._end)
+        if round_trips(text):
+            return text
+        # SFMRecord's rebuilt string omits a space that directly follows the marker and precedes a newline,
+        # and adds one where a field has neither a space nor a newline. Do the same here, piece by piece.
+        pieces = []
+        for i in range(len(self._starts)):
+            start, end = self._bounds(i)
+            breakat, datastart = break_pos(data, start, end)
+            if breakat != datastart and data[datastart:datastart+1] in ('\n', b'\n'):
+                pieces += [self._text(start, breakat), self._text(datastart, end)]
+            elif breakat == end:
+                pieces += [self._text(start, end), ' ']
+            else:
+                pieces.append(self._text(start, end))
+        return ''.join(pieces)
+
+    def split(self, markers):
+        ''' Like SFMRecord.split, but the pieces of an unparsed record are views too. '''
+        if self._fields_split is not None:
+            return SFMRecord.split(self, markers)
+        indexes = [x[1] for x in self.find(markers)]
+        if not indexes:
+            return [self]
+        recs = []
+        for i, j in zip([0]+indexes, indexes+[None]):
+            starts = self._starts[i:j]
+            if starts:
+                end = self._starts[j] if j is not None else self._end
+                rec = type(self)(self._data, starts, end, self.location, self._table)
+                if self._ids is not None:
+                    rec._ids = self._ids[i:j]
+                recs.append(rec)
+            else:  # (e.g. splitting on the first marker yields an empty first chunk, as with SFMRecord)
+                recs.append(SFMRecord.from_lists([], cursor=self.location))
+        return recs
+
+    def find_first(self, targets):
+        ''' Like SFMRecord.find_first. The record only gets parsed if a target is found (since the caller may modify that field). '''
+        if self._fields_split is not None:
+            return SFMRecord.find_first(self, targets)
+        if not targets: return None
+        if isinstance(targets, MarkerSet) and targets.table is self._table:
+            mkrs = self.marker_ids()  # compare IDs rather than strings
+        else:
+            mkrs = self._markers()
+        for i, mkr in enumerate(mkrs):
+            if mkr in targets:
+                return self.as_lists()[i]
+        return None
+
+    def find(self, targets, start=0, bounds=[]):
+        ''' Like SFMRecord.find, but only looks at the markers (via the marker index). '''
+        if self._fields_split is not None:
+            return SFMRecord.find(self, targets, start, bounds)
+        index = self._marker_index()
+        if index is not None:
+            return self._find_indexed(index, targets, start, bounds)
+        names = self.marker_table().names
+        if isinstance(targets, MarkerSet) and targets.table is self._table and (not bounds or isinstance(bounds, MarkerSet) and bounds.table is self._table):
+            mkrs = self.marker_ids()  # compare IDs rather than strings
+        else:
+            mkrs = self._markers()
+        i = start
+        sns = []
+        while i < len(mkrs):
+            mrk = mkrs[i]
+            if mrk in targets:
+                sns.append((names[mrk] if type(mrk) is int else mrk, i))
+            elif mrk in bounds:
+                break
+            i += 1
+        return sns
+
+    def find_values(self, targets, start=0, bounds=[]):
+        ''' Like SFMRecord.find_values, but only slices out the values that were found. '''
+        if self._fields_split is not None:
+            return SFMRecord.find_values(self, targets, start, bounds)
+        return [self._value(v).strip() for _m, v in self.find(targets, start, bounds)]
+
+
 class SFMFieldReader:
     ''' An iterator that returns the contents of an SFM file, one field at a time.
 
@@ -348,10 +818,10 @@ class SFMFieldReader:
         self.afile = sfmfile
         self.nomore = False
         tmp = self.afile.readline()
-        self.cursor = 1  #TODO: changing this to 0 maybe is better but is buggy! . Also, the number for the first record in the file is off by one.
-        if ord(tmp[0]) == BOM: 
+        self.cursor = 1  #the number of the line in the buffer (i.e. where the next field begins)
+        if tmp and ord(tmp[0]) == BOM: 
             tmp = tmp[1:]  #strip off the Byte Order Mark for now
-            self.header += BOM  #but make sure the file doesn't get changed
+            self.header += chr(BOM)  #but make sure the file doesn't get changed
         while True:
             if not tmp:
                 self.nomore = True #end of file
@@ -377,9 +847,11 @@ class SFMFieldReader:
 
         while True:
             temp = self.afile.readline()
-            self.cursor += 1  #TODO: figure out why this gets off track
+            self.cursor += 1
             if not temp:
                 self.nomore = True #end of file; next time, we'll raise a StopIteration
+                if not field.endswith('\n'):
+                    self.cursor -= 1  #the last line had no newline, so no new line was started
                 break
             elif temp.startswith('\\'):
                 self._buffer = temp #save this line for later
@@ -389,20 +861,170 @@ class SFMFieldReader:
         return field
 
 
+FIELD_START = re.compile(r'^\\', re.MULTILINE)  # a backslash at the beginning of a line begins a new field
+FIELD = re.compile(r'\\[^\n]*(?:\n(?!\\)[^\n]*)*\n?')  # a field's first line, plus any lines that don't begin with a backslash. (No ^ needed; fields are contiguous.)
+FIELD_START_BYTES = re.compile(br'^\\', re.MULTILINE)  # the same two regexes, for UTF-8 data that hasn't been decoded
+FIELD_BYTES = re.compile(br'\\[^\n]*(?:\n(?!\\)[^\n]*)*\n?')
+NEWLINE, NEWLINE_BYTES = re.compile('\n'), re.compile(b'\n')
+CHUNK_SIZE = 1 << 20  # how many characters SFMBufferReader splits into fields at a time
+
+class SFMBufferReader:
+    ''' An alternative to SFMFieldReader. It returns exactly the same fields, header and cursor values, but
+    reads the whole file (or string) into one buffer up front and then splits that buffer into fields with one
+    compiled regex, a large chunk at a time, rather than calling readline() once per line and concatenating.
+
+    The trade-off is memory: the whole text is held in memory while reading. (Scripts that do list(records)
+    hold all of it anyway.) In practice, building the records costs far more than finding the fields, so
+    SFMRecordReader still uses SFMFieldReader by default; pass field_reader=SFMBufferReader to it to use this one.
+
+    It can also split undecoded UTF-8 (bytes, or a file opened in binary mode); the fields and header are then
+    bytes too. (SFMBytesRecordReader uses it that way.) Or, pass errors='strict' or 'replace' to have such data
+    decoded (and checked) as it's read in; see decode_checked. Any problems found are listed in encoding_errors.
+    Initialization requires:
+    - A string or bytes, or an open file that's ready to be read from.
+    '''
+
+    def __iter__(self):
+        return self
+
+    def __init__(self, sfmfile, errors=None, max_errors=9):
+        ''' Read in the data and deal with the header (and any BOM). '''
+        self._line, self._line_pos = 1, 0  # a known line number, and the offset it was counted up to
+        self._newlines = None
+        if isinstance(sfmfile, (str, bytes)): #if a string of data was passed instead of a file handle
+            data = sfmfile
+        else:
+            data = sfmfile.read()
+        self.encoding_errors = []
+        if errors and isinstance(data, bytes):
+            data, self.encoding_errors = decode_checked(data, errors, max_errors)
+            if '\r' in data:  #translate line endings, as open() does in text mode
+                data = data.replace('\r\n', '\n').replace('\r', '\n')
+        self.data = data
+        if isinstance(data, bytes):
+            bom, tag, self._newline, self._field = chr(BOM).encode('utf-8'), HEADER_TAG.encode('ascii'), b'\n', FIELD_BYTES
+            field_start = FIELD_START_BYTES
+        else:
+            bom, tag, self._newline, self._field = chr(BOM), HEADER_TAG, '\n', FIELD
+            field_start = FIELD_START
+        self._boundary = self._newline + tag[:1]  #a newline followed by a backslash
+        empty = data[:0]
+        self.header = empty #to store any lines that precede the first true record in the file
+        self._buffer = empty #the next field, which we've found but not yet returned
+        self.nomore = False
+        self._chunk = iter(())  # fields found in the current chunk
+
+        pos = 0
+        if data.startswith(bom):
+            pos = len(bom)  #skip the Byte Order Mark for now
+            self.header += bom  #but make sure the file doesn't get changed
+
+        # Header lines are any lines that don't begin with a backslash, or that begin with the header tag.
+        # Note: ^ doesn't match right after a BOM, so the first line is checked separately.
+        start = len(data)
+        if data.startswith(tag[:1], pos) and not data.startswith(tag, pos):
+            start = pos
+        else:
+            for m in field_start.finditer(data, pos):
+                if not data.startswith(tag, m.start()):
+                    start = m.start()
+                    break
+        self.header += data[pos:start]
+        self._start = self._pos = start  # offset of the buffered field; offset of the next chunk
+        self._advance()
+
+    @property
+    def newlines(self):
+        ''' A compact array of the offsets of every newline in the data. (It's built the first time it's needed.) '''
+        if self._newlines is None:
+            regex = NEWLINE_BYTES if isinstance(self.data, bytes) else NEWLINE
+            self._newlines = array('Q', (m.start() for m in regex.finditer(self.data)))
+        return self._newlines
+
+    def line_number(self, offset):
+        ''' Return the number of the line (counting from 1) that contains this offset into the data.
+
+        Line numbers are counted incrementally from the last offset asked about, so asking about offsets
+        in increasing order (as the readers do) only ever counts each newline once. An earlier offset is
+        looked up in the newlines table instead.'''
+        if offset < self._line_pos:
+            return bisect_left(self.newlines, offset) + 1
+        self._line += self.data.count(self._newline, self._line_pos, offset)
+        self._line_pos = offset
+        return self._line
+
+    @property
+    def cursor(self):
+        ''' The line number where the buffered field begins. (Same numbering as SFMFieldReader's cursor.) '''
+        return self.line_number(self._start)
+
+    def _advance(self):
+        ''' Move the next field into the buffer, splitting another chunk of the data into fields if needed. '''
+        field = next(self._chunk, None)
+        if field is None:
+            data = self.data
+            if self._pos >= len(data):
+                self._buffer = data[:0]
+                self.nomore = True #end of data; next time, we'll raise a StopIteration
+                return
+            end = data.find(self._boundary, self._pos + CHUNK_SIZE)  # end the chunk on a field boundary
+            end = len(data) if end == -1 else end + 1
+            self._chunk = iter(self._field.findall(data, self._pos, end))
+            self._pos = end
+            field = next(self._chunk)
+        self._buffer = field
+
+    def next_span(self):
+        ''' Advance to the next field, like __next__, but return its (start, end) offsets within self.data
+        rather than its text.'''
+        if self.nomore: raise StopIteration #we ran out of fields last time
+        start = self._start
+        self._start += len(self._buffer)
+        self._advance()
+        return start, self._start
+
+    def __next__(self):
+        ''' Returns the next field. (This is the method a for loop will call.)
+        '''
+        if self.nomore: raise StopIteration #we ran out of fields last time
+        field = self._buffer
+        self._start += len(field)
+        self._buffer = next(self._chunk, None)
+        if self._buffer is None:
+            self._advance()
+        return field
+
+
 class SFMRecordReader:
     
-    ''' An iterator that returns the contents of an SFM file one record at a time (using SFMFieldReader).
+    ''' An iterator that returns the contents of an SFM file one record at a time.
+    
+    The fields are read by SFMFieldReader by default (or by SFMBufferReader if errors is given); pass
+    field_reader=SFMBufferReader to read the whole file into a buffer instead.
+
+    To check a file's encoding while reading it (rather than in a separate pass), open it in binary mode and pass
+    errors='strict' (raise a UnicodeDecodeError listing the first few problems) or errors='replace' (replace bad
+    bytes with U+FFFD, keep going, and list the first few problems in encoding_errors). See decode_checked.
     '''
 
     def __iter__(self):       
         return self
 
-    def __init__(self, dictfile, recordmarker=RECORD_MARKER):
+    def __init__(self, dictfile, recordmarker=RECORD_MARKER, field_reader=None, errors=None):
         self.recordmarker = recordmarker
         self._buffer=""  #used for one FIELD of lookahead
         self.nomore=False
-        self._fields = SFMFieldReader(dictfile)
+        if field_reader is None:
+            field_reader = SFMBufferReader if errors else SFMFieldReader
+        if errors:  #decode a binary file while reading it (SFMBufferReader only)
+            self._fields = field_reader(dictfile, errors)
+            self.encoding_errors = self._fields.encoding_errors
+        else:
+            self._fields = field_reader(dictfile)
+            self.encoding_errors = []
         self.header = self._fields.header  #any lines that precede the first true record in the file
+        self.markers = MarkerTable()  #shared by all the records this reader returns
+        self._buffer_line = None  #the line number where the field in our buffer began
 
         #find the first record's first line; dump into the header any fields found before that
         while True:
@@ -415,165 +1037,724 @@ class SFMRecordReader:
         if self.nomore: raise StopIteration #we ran out of fields last time
         lines=[]
         firstfield = True
-        cur = self._fields.cursor - 1  #TODO: fix (shouldn't need the -1)
+        cur = self._fields.cursor  #the line where the record's first field begins
         if self._buffer:
             #use the \lx field from last time as our starting point
             lines.append(self._buffer)
             self._buffer = ""
+            cur = self._buffer_line
             firstfield = False
-        halt=False
-        while not halt:
+        prefix = '\\' + self.recordmarker
+        next_field, append = self._fields.__next__, lines.append
+        while True:
             try:
-                temp = self._fields.__next__()
-                [mkr, _data] = break_field(temp)
-                if mkr == self.recordmarker and not firstfield:
-                    self._buffer=temp #done; save this line/field for later
-                    halt=True
-                else:
-                    firstfield=False
-                    lines.append(temp) #append; keep going
+                temp = next_field()
             except StopIteration:
                 self.nomore=True #next time, we'll raise a StopIteration ourselves
-                halt=True
-        #TODO: test using try with break instead of halt=True.
-        return SFMRecord(lines, cur)
+                break
+            if temp.startswith(prefix) and not firstfield and break_field(temp)[0] == self.recordmarker:
+                self._buffer=temp #done; save this line/field for later
+                self._buffer_line = self._fields.cursor - temp.count('\n')  #(the cursor is now just past it)
+                break
+            firstfield=False
+            append(temp) #append; keep going
+        return SFMRecord(lines, cur, self.markers)
 
 
-def get_stats(recs, tally_fields=TALLY_FIELDS, entry_fields=ENTRY_FIELDS):
-    ''' Given an iterable of SFM records, compile stats about the SFM file. Return a report string.
-    
-    Assumptions:
-    - The markers will all be basic ASCII. Unicode characters beyond the ASCII will be tallied if found in the field values.
+class SFMLazyRecordReader(SFMRecordReader):
+    ''' Like SFMRecordReader, but returns SFMRecordView objects, which parse only as much of each record as is
+    actually used. The fields are found by an SFMBufferReader, but are never copied out of its buffer here.
+
+    If compact is True, each record instead gets its own copy of its text, with its field offsets stored in
+    a typed array. Use this when loading a whole file into memory: a list of these takes a fraction of the
+    memory of a list of SFMRecords, and doesn't keep the reader's buffer alive.
     '''
 
-    def count_uni(ustr, valD):
-        ''' Given a unicode string and a defaultdict, tally up any non-ASCII characters found in the string.
-        '''
-        for c in ustr:
-            if ord(c) > 127:
-                valD[c] += 1
-
-    def check_misplaced_hm(rec, hm='hm', lx=RECORD_MARKER):
-        ''' Given an SFMRecord, print a warning if it contains an hm field that's not immediately after a record marker.'''
-        report = ''
-        lxval = rec.as_lists()[0][1].strip()
-        loc = "entry [{}] near line {}".format(lxval, rec.location)
-        msg = "  MDF defines homograph numbers as applying to lx (not se). Note: if you instead append a number to an se, the FLEx importer does understand that."
-        matches = rec.find([hm])
-        if len(matches) > 1:
-            report += "WARNING: multiple {} fields found in a single record: {}\n{}\n".format(hm, loc, msg)
-        elif matches and matches[0][1] != 1:
-            report += "WARNING: {} field was found somewhere other than as the second field: {}\n{}\n".format(hm, loc, msg)
-        return report
-
-    rep = ''
-    uniD = defaultdict(lambda: int(0)) # unicode characters and counts
-    numD = defaultdict(lambda: int(0)) # markers whose values sometimes end in numbers, and counts
-    mkrD = defaultdict(lambda: list([0, 0])) # key = SFM markers; val = two counts (total, and non-empty)
-    valD = dict()
-    for f in tally_fields:
-        valD[f] = defaultdict(lambda: int(0)) # key = values for selected markers (e.g. ps, lf); val = count
-    rec_count, entry_count = 0, 0
-    ps_first_count, sn_first_count, neither_count, ps_missing_count = 0, 0, 0, 0
-	#TODO: also count the number of blank PS fields; if > 0 report problem with LT-10739
+    view = SFMRecordView  #the class of record returned
+
+    def __init__(self, dictfile, recordmarker=RECORD_MARKER, compact=False, errors=None):
+        SFMRecordReader.__init__(self, dictfile, recordmarker, SFMBufferReader, errors)
+        self.compact = compact
+        self._next_start = None #where the next record begins (i.e. the offset of the \lx field from last time)
+        self._marker = recordmarker  #the record marker, and the prefix of its fields, as found in the buffer
+        self._prefix = '\\' + recordmarker
+
+    def __next__(self):
+        if self.nomore: raise StopIteration #we ran out of fields last time
+        fields = self._fields
+        data = fields.data
+        starts = array('L')
+        if self._next_start is not None:
+            starts.append(self._next_start)
+        prefix, marker = self._prefix, self._marker
+        end = None
+        while True:
+            try:
+                start, stop = fields.next_span()
+            except StopIteration:
+                self.nomore = True #next time, we'll raise a StopIteration ourselves
+                end = len(data)  #(the record runs to the end of the data, even if it's just the field from last time)
+                break
+            if starts and data.startswith(prefix, start) and data[start+1:break_pos(data, start, stop)[0]] == marker:
+                self._next_start = start #done; save this field's location for later
+                end = start
+                break
+            starts.append(start)
+            end = stop
+        cur = fields.line_number(starts[0]) if starts else fields.cursor  #the line where the record's first field begins
+        if self.compact:
+            base = starts[0]
+            text = data[base:end]
+            starts = array('H' if len(text) < 65536 else 'L', [x - base for x in starts])
+            return self.view(text, starts, len(text), cur, self.markers)
+        return self.view(data, starts, end, cur, self.markers)
+
+
+class SFMBytesRecordView(SFMRecordView):
+    ''' An SFMRecordView over undecoded UTF-8 (as returned by SFMBytesRecordReader). Everything it returns is str,
+    as usual, but only the pieces actually asked for get decoded. Markers are tiny, so code that only looks at
+    markers (counting records, tallying markers, finding \\ps or \\hm fields) decodes almost nothing.
+
+    A decoding error is raised only when a bad field is actually used, and its start and end are
+    offsets into the whole buffer (not just the piece being decoded), so the bad bytes can be located.
+    '''
+    __slots__ = ()
+
+    def _text(self, start, end):
+        ''' Decode the text found between these two offsets in the buffer. '''
+        try:
+            return self._data[start:end].decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise UnicodeDecodeError(e.encoding, self._data, start + e.start, start + e.end, e.reason) from None
+
+
+class SFMBytesRecordReader(SFMLazyRecordReader):
+    ''' Like SFMLazyRecordReader, but for UTF-8 data that hasn't been decoded: pass it bytes, or a file opened
+    in binary mode ('rb'). This skips decoding the whole file up front; instead, each record is an
+    SFMBytesRecordView, which decodes only the fields (or markers) that are used.
+
+    The header is decoded right away, so it's a str, as usual. Note that invalid UTF-8 in the records
+    won't be noticed until the bad field is used.
+    '''
+
+    view = SFMBytesRecordView
+
+    def __init__(self, dictfile, recordmarker=RECORD_MARKER, compact=False):
+        self.recordmarker = recordmarker
+        self._buffer = ""
+        self.nomore = False
+        self._fields = SFMBufferReader(dictfile)
+        self.markers = MarkerTable()  #shared by all the records this reader returns
+        self.compact = compact
+        self._next_start = None
+        self._marker = recordmarker.encode('utf-8')
+        self._prefix = b'\\' + self._marker
+
+        #dump into the header any fields found before the first record (as SFMRecordReader does)
+        fields = self._fields
+        header = fields.header
+        while fields._buffer:
+            field = fields._buffer
+            if field.startswith(self._prefix) and field[1:break_pos(field)[0]] == self._marker: break
+            header += fields.__next__()
+        self.header = header.decode('utf-8')
+
+
+PARALLEL_CHUNK_MIN = 1 << 20  # SFMParallelRecordReader never splits the file into chunks smaller than this (in bytes)
+
+def find_record(data, recordmarker=RECORD_MARKER, pos=0, end=None):
+    ''' Return the offset of the first field at or after pos (which must be the start of a line) in the UTF-8
+    bytes (or mmap) data whose marker is recordmarker. If there is none before end, return end.
+    The first line is checked even if it follows a BOM.'''
+    if end is None: end = len(data)
+    marker = recordmarker.encode('utf-8')
+    bom = chr(BOM).encode('utf-8')
+    if data[pos:pos+len(bom)] == bom:
+        pos += len(bom)
+    prefix = b'\\' + marker
+    while pos < end:
+        if data[pos:pos+len(prefix)] == prefix:
+            stop = data.find(b'\n\\', pos, end)
+            stop = end if stop == -1 else stop + 1
+            field = data[pos:stop]
+            if field[1:break_pos(field)[0]].rstrip(b'\r') == marker:  #(a CRLF file's \r isn't part of the marker)
+                return pos
+        pos = data.find(b'\n' + prefix, pos, end)
+        if pos == -1: break
+        pos += 1
+    return end
+
+def record_ranges(fname, recordmarker=RECORD_MARKER, workers=1):
+    ''' Split a (UTF-8) file at record boundaries into byte ranges for the given number of worker processes to
+    parse (a few ranges per worker, to balance the load). Return the header (decoded) and a list of (start, end)
+    offsets; the first range starts at the first record. '''
+    with open(fname, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+    try:
+        first = find_record(data, recordmarker)
+        header = data[:first].decode('utf-8')
+        chunk_size = max(PARALLEL_CHUNK_MIN, (size - first) // (workers * 4) + 1)
+        bounds = [first]
+        while bounds[-1] < size:
+            pos = bounds[-1] + chunk_size
+            pos = data.find(b'\n', pos) + 1 if pos < size else 0  #(0 means there are no more lines)
+            bounds.append(find_record(data, recordmarker, pos, size) if pos else size)
+    finally:
+        if size: data.close()
+    return header, list(zip(bounds, bounds[1:]))
+
+def _read_range(fname, start, end, recordmarker, compact):
+    ''' Parse the records found between two byte offsets of the file (the first one being the start of a record).
+    Runs in a worker process for SFMParallelRecordReader. Returns a list of (data, starts, end, location) tuples
+    (line numbers relative to the start of this range), and the number of newlines in the range.'''
+    with open(fname, 'rb') as infile:
+        infile.seek(start)
+        text = infile.read(end - start).decode('utf-8')
+    if '\r' in text:  #translate line endings, as SFMLazyRecordReader does for a file opened in text mode
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    reader = SFMLazyRecordReader(text, recordmarker, compact)
+    return [(r._data, r._starts, r._end, r.location) for r in reader], text.count('\n')
+
+class SFMParallelRecordReader:
+    ''' Like SFMLazyRecordReader, but parses the file on several CPU cores at once. The file is split (at record
+    boundaries) into byte ranges, which a pool of worker processes parse; the records are still returned in
+    their original order, with the same header, locations and contents as SFMLazyRecordReader would give.
+
+    The records are SFMRecordViews (compact ones, if compact is True). Unlike the other readers, this one
+    needs the name of a (UTF-8) file rather than an open file or a string, so that each worker can read its
+    own part of the file. If workers is 1, no processes are started; the chunks are parsed one at a time.
+    (Default: one worker per core.)
+    '''
+
+    def __iter__(self):
+        return self
+
+    def __init__(self, fname, recordmarker=RECORD_MARKER, workers=None, compact=False):
+        self.recordmarker = recordmarker
+        self.workers = workers or os.cpu_count() or 1
+        self.markers = MarkerTable()  #shared by all the records this reader returns
+        header, self._ranges = record_ranges(fname, recordmarker, self.workers)
+        self.header = header.replace('\r\n', '\n').replace('\r', '\n')
+        self._records = self._generate(fname, compact)
+
+    def _generate(self, fname, compact):
+        ''' Yield the records of each range in order (starting the worker processes first, if any). '''
+        args = [(fname, start, end, self.recordmarker, compact) for start, end in self._ranges]
+        if not args:
+            return
+        if self.workers == 1 or len(args) < 2:
+            yield from self._views(map(_read_range, *zip(*args)))
+        else:
+            with ProcessPoolExecutor(self.workers) as executor:
+                yield from self._views(executor.map(_read_range, *zip(*args)))
+
+    def _views(self, results):
+        ''' Turn each range's results into records, adjusting their locations to count from the start of the file. '''
+        line = self.header.count('\n')  #how many lines precede the current range
+        for recs, lines in results:
+            for data, starts, end, location in recs:
+                yield SFMRecordView(data, starts, end, location + line, self.markers)
+            line += lines
+
+    def __next__(self):
+        return next(self._records)
+
+
+class _RecordSplitter:
+    ''' Splits text that arrives a piece at a time into runs of lines, each beginning with a line that starts
+    with the record marker (except the first run, which is whatever comes before the first record). '''
+
+    def __init__(self, recordmarker=RECORD_MARKER):
+        self._prefix = '\\' + recordmarker
+        self._start = re.compile('^' + re.escape(self._prefix) + '(?=[ \n])', re.MULTILINE)
+        self._held, self._pos = [], 0  #the text of the incomplete run, as it arrived (joined only when needed)
+
+    def feed(self, text):
+        ''' Take some more text; return a list of the runs that are now complete. '''
+        held = self._held
+        # Only rescan the held text if a run could begin in the new text (or straddle its start).
+        rescan = not held or self._prefix in held[-1][-len(self._prefix):] + text
+        held.append(text)
+        if not rescan:
+            return []
+        buffer = ''.join(held)
+        bounds = [m.start() for m in self._start.finditer(buffer, self._pos)]
+        if not bounds:
+            self._held = [buffer]
+            return []
+        pieces = [buffer[a:b] for a, b in zip([0] + bounds, bounds)]
+        self._pos = 1  #from now on, the buffer always begins with a record (so don't split there)
+        self._held = [buffer[bounds[-1]:]]
+        return pieces
+
+    def finish(self):
+        ''' Return the last run (if any). '''
+        buffer, self._held = ''.join(self._held), []
+        return [buffer] if buffer else []
+
+class SFMDeltaWriter:
+    ''' A file-like object that takes the new text of an SFM file (via write) but, rather than saving all of it,
+    just saves a patch (delta) listing the records that differ from those in the original file. So a review only
+    needs to look at what actually changed, and a run that changes nothing writes almost nothing.
+    Call finish() after writing everything. apply_delta() turns the original and the patch into the new file.
+
+    The patch is a DELTA_HEADER line followed by a hunk for each run of changed records:
+        @@ <line> <lines> -<before> +<after>
+    then the original text of those records (<before> characters, beginning on line <line> and spanning <lines>
+    newlines), immediately followed by their new text (<after> characters). Records that were inserted or deleted
+    just make one side longer. Write the patch with newline='', so that the character counts stay exact.
+
+    Both files are compared a record at a time as they're read, so neither needs to be held in memory. (If
+    records change so much that the two can't be matched up again within window records, that whole window
+    becomes one hunk; the patch is still correct, just less concise.)
+    '''
+
+    def __init__(self, original, patchfile, recordmarker=RECORD_MARKER, window=DELTA_WINDOW, chunk_size=1<<20):
+        self.original, self.patchfile = original, patchfile  #(the original must be open in text mode)
+        self.window, self.chunk_size = window, chunk_size
+        self.hunks = 0
+        self._old, self._new = _RecordSplitter(recordmarker), _RecordSplitter(recordmarker)
+        self._before, self._after = deque(), deque()
+        self._old_done = False
+        self._line = 1  #where the first of the _before records begins
+        patchfile.write(DELTA_HEADER + '\n')
+
+    def write(self, text):
+        self._after.extend(self._new.feed(text))
+        self._compare()
+
+    def finish(self):
+        ''' Save whatever differences remain, once all of the new text has been written. Return the number of hunks. '''
+        self._after.extend(self._new.finish())
+        self._compare(True)
+        return self.hunks
+
+    def _read_original(self, wanted):
+        while not self._old_done and len(self._before) < wanted:
+            data = self.original.read(self.chunk_size)
+            if data:
+                self._before.extend(self._old.feed(data))
+            else:
+                self._before.extend(self._old.finish())
+                self._old_done = True
+
+    def _compare(self, final=False):
+        before, after = self._before, self._after
+        while after or final:
+            self._read_original(max(len(after), self.window) + 1)
+            if not after:  #(so this is the end) any original records that remain were deleted
+                self._read_original(float('inf'))
+                if before: self._hunk(len(before), 0)
+                return
+            if before and before[0] == after[0]:
+                self._line += before.popleft().count('\n')
+                after.popleft()
+                continue
+            if len(after) < self.window and not final:
+                return  #wait for more new text, so there's something to match up with
+            self._hunk(*self._resync())
+
+    def _resync(self):
+        ''' Return the numbers of original and new records to put in a hunk: as few as possible, such that the
+        records after them match. '''
+        old = list(islice(self._before, self.window))
+        new = list(islice(self._after, self.window))
+        index = {}
+        for b, text in enumerate(new):
+            index.setdefault(text, b)
+        best = len(old), len(new)
+        for a, text in enumerate(old):
+            b = index.get(text)
+            if b is not None and a + b < sum(best):
+                best = a, b
+        return best
+
+    def _hunk(self, a, b):
+        before = ''.join(self._before.popleft() for _ in range(a))
+        after = ''.join(self._after.popleft() for _ in range(b))
+        lines = before.count('\n')
+        self.patchfile.write('@@ {} {} -{} +{}\n'.format(self._line, lines, len(before), len(after)))
+        self.patchfile.write(before)
+        self.patchfile.write(after)
+        self._line += lines
+        self.hunks += 1
+
+def apply_delta(original, patchfile, outfile):
+    ''' Copy the original file to the output file, replacing records as listed in a patch written by SFMDeltaWriter,
+    in one pass. Raise an exception if the patch doesn't match the original. Return the number of hunks applied.
+    (Open the original in text mode, and the patch with newline=''.)
+    '''
+    if patchfile.readline().rstrip('\n') != DELTA_HEADER:
+        raise Exception('ERROR: This is not an SFM delta (patch) file.')
+    line, hunks = 1, 0
+    for head in iter(patchfile.readline, ''):
+        m = re.match(r'@@ (\d+) (\d+) -(\d+) \+(\d+)\n$', head)
+        if not m:
+            raise Exception('ERROR: Bad hunk header in the delta file: {}'.format(ascii(head)))
+        start, lines, size_before, size_after = [int(n) for n in m.groups()]
+        before, after = patchfile.read(size_before), patchfile.read(size_after)
+        if len(before) + len(after) < size_before + size_after:
+            raise Exception('ERROR: The delta file ends in the middle of a hunk (line {}).'.format(start))
+        while line < start:
+            text = original.readline()
+            if not text: break
+            outfile.write(text)
+            line += 1
+        if line != start or original.read(size_before) != before:
+            raise Exception("ERROR: The delta doesn't match the original file at line {}.".format(start))
+        outfile.write(after)
+        line += lines
+        hunks += 1
+    shutil.copyfileobj(original, outfile)
+    return hunks
+
+
+NON_ASCII = re.compile(r'[^\x00-\x7f]')
+NUMPY_MIN = 1 << 16  # count_chars only hands texts at least this long to NumPy (if it's installed)
+
+def count_chars(text):
+    ''' Return a dictionary of the non-ASCII characters in the text and their counts. For a long text (e.g. all
+    of a marker's values joined together), this uses a NumPy code point histogram, if NumPy is available. '''
+    if text.isascii():
+        return {}
+    if numpy is not None and len(text) >= NUMPY_MIN:
+        codes = numpy.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+        codes, counts = numpy.unique(codes[codes > 127], return_counts=True)
+        return {chr(c): int(n) for c, n in zip(codes.tolist(), counts.tolist())}
+    return Counter(NON_ASCII.findall(text))
+
+class CharInventory:
+    ''' Counts the non-ASCII characters in an SFM file's field values, separately for each marker.
+
+    Like LexiconStats, records can be added and removed, and inventories merged. To count a whole file, use
+    char_inventory, which counts each marker's values in bulk. Characters are reported by count. In the totals,
+    characters with equal counts are listed in the order they were first seen (as get_stats always has), if the
+    records were added one by one; otherwise (and in each marker's list) by code point.
+    (Markers are assumed to be ASCII, and are not counted.)
+    '''
+
+    def __init__(self, ordered=True):
+        self.counts = {}  # key = marker; val = dict of (non-ASCII) characters and counts
+        self.order = {} if ordered else None  # each character, in the order first seen (if that's being kept track of)
+
+    def add_text(self, mkr, text, sign=1):
+        ''' Count (or, with sign=-1, uncount) the characters of one or more values of this marker. '''
+        if text.isascii():
+            return
+        counts = self.counts.setdefault(mkr, {})
+        found = count_chars(text)
+        order = self.order
+        if order is not None and sign > 0 and not order.keys() >= found.keys():
+            for ch in sorted(found.keys() - order.keys(), key=text.index):
+                order[ch] = None
+        for ch, n in found.items():
+            n = counts.get(ch, 0) + n * sign
+            if n:
+                counts[ch] = n
+            else:
+                del counts[ch]
+        if not counts:
+            del self.counts[mkr]
+
+    def add(self, rec):
+        ''' Count the characters in an SFMRecord's field values. '''
+        for mkr, val in rec.fields():
+            self.add_text(mkr, val)
+
+    def remove(self, rec):
+        ''' Uncount a record that was previously added (or an identical copy of it). '''
+        for mkr, val in rec.fields():
+            self.add_text(mkr, val, -1)
+
+    def merge(self, other):
+        ''' Add another CharInventory's counts into this one (as if its records had been added after ours). '''
+        if self.order is not None and other.order is not None:
+            for ch in other.order:
+                self.order.setdefault(ch)
+        else:
+            self.order = None
+        for mkr, theirs in other.counts.items():
+            ours = self.counts.setdefault(mkr, {})
+            for ch, n in theirs.items():
+                ours[ch] = ours.get(ch, 0) + n
+        return self
+
+    def totals(self):
+        ''' Return a dictionary of each character's count across all markers. '''
+        totals = Counter()
+        for counts in self.counts.values():
+            totals.update(counts)
+        return totals
+
+    @staticmethod
+    def _rows(counts, order=None):
+        ''' Return report lines (count , char , code point , name) for a dictionary of characters and counts, sorted
+        by count, and then in the given order of characters (if any) or by code point. '''
+        if order is None:
+            items = sorted(counts.items(), key=lambda x: (x[1], x[0]))
+        else:
+            items = sorted(((ch, counts[ch]) for ch in order if ch in counts), key=lambda x: x[1])
+        return ["  {} , {} , {} , {}\n".format(n, ch, ch.encode('unicode-escape').decode(), unicodedata.name(ch, ''))
+                for ch, n in items]
+
+    def report(self, by_field=True):
+        ''' Return the inventory as a report string: the totals, and then (unless by_field is False) the characters found in each marker. '''
+        rep = ["Non-ASCII characters (characters above char 127):\n", " count , char , code point , name\n"]
+        rep += self._rows(self.totals(), self.order)
+        rep.append("\n")
+        if by_field:
+            rep.append("Non-ASCII characters by field:\n")
+            for mkr in sorted(self.counts):
+                rep.append("Field {}:\n".format(mkr))
+                rep += self._rows(self.counts[mkr])
+            rep.append("\n")
+        return ''.join(rep)
+
+def char_inventory(recs):
+    ''' Given an iterable of SFM records, return a CharInventory of their field values. Each marker's values are
+    gathered up and then counted all at once, which is much faster than adding the records one by one. '''
+    values = defaultdict(list)
     for rec in recs:
-        rec_count += 1
+        for mkr, val in rec.fields():
+            if not val.isascii():
+                values[mkr].append(val)
+    inventory = CharInventory(ordered=False)
+    for mkr, vals in values.items():
+        inventory.add_text(mkr, ''.join(vals))
+    return inventory
+
+class LexiconStats:
+    ''' Accumulates the statistics that get_stats reports about an SFM file, one record at a time.
+
+    Records can be added and removed (e.g. after an edit, remove the old version of a record and add the new one),
+    and the stats for separate chunks or files can be merged, so a partial result never needs to be recomputed
+    from the records. Each of these costs time in proportion to the record (or, for merge, the number of distinct
+    markers, values and characters), not to the size of the corpus.
+    Call report() to render the stats as text. Items with equal counts are listed in the order they were first seen,
+    so merging chunks in file order gives the same report as adding their records one by one.
+    If the reader's MarkerTable is passed in as markers, marker tests will use its MarkerSets (i.e. compare IDs where possible).
+    '''
+    re_ends_in_num = re.compile(r'.*\D\d+$')  # a number at the end of the line, when the whole field is not numeric
+
+    def __init__(self, tally_fields=TALLY_FIELDS, entry_fields=ENTRY_FIELDS, markers=None):
+        self.tally_fields, self.entry_fields = tuple(tally_fields), tuple(entry_fields)
+        self.rec_count, self.entry_count = 0, 0
+        self.ps_first_count, self.sn_first_count, self.neither_count, self.ps_missing_count = 0, 0, 0, 0
+        self.chars = CharInventory() # non-ASCII characters and counts, per marker
+        self.numbered = {} # markers whose values sometimes end in numbers, and counts
+        self.mkrs = {} # key = SFM markers; val = two counts (total, and non-empty)
+        self.values = {f: {} for f in self.tally_fields} # key = values for selected markers (e.g. ps, lf); val = count
+        self.warnings = [] # in record order; each is (message, lx value, line number)
+        self._sets = self.tally_fields, self.entry_fields, [HM], [PS], [PS, SN]
+        if markers is not None:
+            self._sets = [markers.marker_set(x) for x in self._sets]
+
+    def add(self, rec):
+        ''' Add an SFMRecord to the stats. '''
+        self._tally(rec, 1)
+
+    def remove(self, rec):
+        ''' Remove an SFMRecord that was previously added (or an identical copy of it) from the stats. '''
+        self._tally(rec, -1)
+
+    def merge(self, other):
+        ''' Add all of another LexiconStats' counts into this one (as if its records had been added after ours). '''
+        if (other.tally_fields, other.entry_fields) != (self.tally_fields, self.entry_fields):
+            raise ValueError('Cannot merge stats that tallied different fields.')
+        self.rec_count += other.rec_count
+        self.entry_count += other.entry_count
+        self.ps_first_count += other.ps_first_count
+        self.sn_first_count += other.sn_first_count
+        self.neither_count += other.neither_count
+        self.ps_missing_count += other.ps_missing_count
+        self.chars.merge(other.chars)
+        for ours, theirs in [(self.numbered, other.numbered)] + [(self.values[f], other.values[f]) for f in self.tally_fields]:
+            for key, count in theirs.items():
+                ours[key] = ours.get(key, 0) + count
+        for mkr, (total, nonempty) in other.mkrs.items():
+            counts = self.mkrs.setdefault(mkr, [0, 0])
+            counts[0] += total
+            counts[1] += nonempty
+        self.warnings.extend(other.warnings)
+        return self
+
+    @staticmethod
+    def _bump(d, key, sign):
+        ''' Add sign to d[key], dropping the key when its count falls to zero. '''
+        count = d.get(key, 0) + sign
+        if count:
+            d[key] = count
+        else:
+            del d[key]
 
-        rstr = rec.as_string()
-        try:  # Are there any non-ASCII characters here?
-            tmp = rstr.encode('ascii')
-        except UnicodeEncodeError:  #  Yup. Count them.
-            count_uni(rstr, uniD)
+    def shift_lines(self, lines):
+        ''' Add this many lines to the line numbers in the warnings (e.g. when these stats were compiled from
+        a later part of a file, before merging them). '''
+        self.warnings = [(msg, lxval, loc if loc is None else loc + lines) for msg, lxval, loc in self.warnings]
+        return self
 
-        rep += check_misplaced_hm(rec)
+    def _hm_warnings(self, rec):
+        ''' Given an SFMRecord, return a list of warnings if it contains an hm field that's not immediately after a record marker.'''
+        matches = rec.find(self._sets[2])
+        if len(matches) > 1:
+            msg = "WARNING: multiple {} fields found in a single record: {}\n{}\n"
+        elif matches and matches[0][1] != 1:
+            msg = "WARNING: {} field was found somewhere other than as the second field: {}\n{}\n"
+        else:
+            return []
+        return [(msg, rec.field(0)[1].strip(), rec.location)]
+
+    def __getstate__(self):
+        ''' MarkerSets belong to one reader's MarkerTable, so pickle (e.g. to send back from a worker process)
+        just their marker names. '''
+        state = self.__dict__.copy()
+        state['_sets'] = [s.names() if isinstance(s, MarkerSet) else s for s in self._sets]
+        return state
+
+    def _tally(self, rec, sign):
+        tally_set, entry_set, hm_set, ps_set, ps_sn_set = self._sets
+        bump = self._bump
+        self.rec_count += sign
+
+        #TODO: also count the number of blank PS fields; if > 0 report problem with LT-10739
+        if sign > 0:
+            self.warnings.extend(self._hm_warnings(rec))
+        else:
+            for w in self._hm_warnings(rec):
+                self.warnings.remove(w)
 
-        r = rec.as_lists()
-        for mkr, val in r:
+        for mkr, val in rec.fields():
             if mkr != mkr.strip():
                 raise Exception("PARSE ERROR! marker name contains whitespace")
-            if mkr in entry_fields:
-                entry_count += 1
-            if mkr in tally_fields:
+            if not val.isascii():
+                self.chars.add_text(mkr, val, sign)
+            if mkr in entry_set:
+                self.entry_count += sign
+            if mkr in tally_set:
                 if val.endswith('\n'):
-                  val = val[:-1]
-                valD[mkr][val] += 1
+                    val = val[:-1]
+                bump(self.values[mkr], val, sign)
             val = val.strip()
-            mkrD[mkr][0] += 1  # count marker occurrence
+            counts = self.mkrs.setdefault(mkr, [0, 0])
+            counts[0] += sign  # count marker occurrence
             if val:
-                mkrD[mkr][1] += 1  # count non-empty occurrence
-            tmp = re.findall(r'^.*(\D+)(\d+)$', val) # finds a number at the end of the line, when the whole field is not numeric
-            if tmp:
-                numD[mkr] += 1
+                counts[1] += sign  # count non-empty occurrence
+            if not counts[0]:
+                del self.mkrs[mkr]
+            if self.re_ends_in_num.match(val):
+                bump(self.numbered, mkr, sign)
 
-        if not rec.find([PS]):
-            ps_missing_count += 1
+        if not rec.find(ps_set):
+            self.ps_missing_count += sign
 
-        either = rec.find([PS, SN])
+        either = rec.find(ps_sn_set)
         if either:
-            mkr = either[0][0]
-            if mkr == PS:
-                ps_first_count += 1
+            if either[0][0] == PS:
+                self.ps_first_count += sign
             else:
-                sn_first_count += 1
-#                rep += '\n\n== ' + str(rec.as_lists())
+                self.sn_first_count += sign
         else:
-            neither_count += 1
-    rep += "\n"
-
-    
-    rep += "Record count ({}): {}\n".format(RECORD_MARKER, rec_count)
-    rep += "Entry count ({}): {}\n".format(entry_fields, entry_count)
-    rep += "SFM markers (non-empty count , total count , name):\n"
-    L = sorted(mkrD.items(), key=lambda x: x[1][1])  # each item from items() looks like this: ('rf', [5269],[3]) . The x[1][1] grabs the 3 count.
-    for m in L:
-        rep += "  {} , {} , {}\n".format(m[1][1], m[1][0], m[0])
-    rep += "\n"
-
-    rep += "Checked (very roughly) the relative order of {} and {} (Having a mix of hierarchies is bad! Standard MDF has ps above one or more sn, but limiting it to one sn per ps imports better into FLEx. LT-9353 LT-10739):\n".format(PS, SN)
-    rep += "  {} occurred first in {} records\n".format(PS, ps_first_count)
-    rep += "  {} occurred first in {} records\n".format(SN, sn_first_count)
-    rep += "  neither one occurred in {} records\n".format(neither_count)
-    rep += "Checked roughly for missing {}; it is missing in {} records.\n".format(PS, ps_missing_count)    
-    rep += "In both cases, only checked records, not individual senses/subentries.\n"
-    rep += "WARNING: If importing into FLEx, empty ps fields are a problem. If you have any, consider using find/replace to insert an explicit 'unknown' value (LT-10739, LT-14038).\n\n"
-
-    #TODO: consider removing the numD code altogether, now that we have check_links()
-#    rep += "Fields ending in numbers preceded by non-number(s):\n"
-#    if numD:
-#        L = sorted(numD.items(), key=lambda x: x[1]) 
-#        for m in L:
-#            rep += "  {} {}\n".format(m[1], m[0])
-#        rep += "  If these are link fields these may be fragile links. Consider running a link/homograph checker.\n"
-#    else:
-#        rep += "  None found. This suggests that there are no fragile links in this file. \n"
-#    rep += "\n"
-
-    rep += "Non-ASCII characters (characters above char 127):\n"
-    rep += " count , char , code point , name\n"
-    L = sorted(uniD.items(), key=lambda x: x[1])
-    for m in L:
-        ch = m[0]
-        code = ch.encode('unicode-escape').decode()
-        count = m[1]
-        rep += "  {} , {} , {} , {}\n".format(count, ch, code, unicodedata.name(ch, ''))
-    rep += "\n"
-
-    rep += "Tallying values for specified fields... ({})\n".format([x[0] for x in valD.items()])
-    for v in valD:
-        L = valD[v].items()
-        if L:
-            rep += "Tallied values for field {}: \n".format(v)
-            L = sorted(L, key=lambda x: x[0].casefold())  # x[0] to sort by value; x[1] to sort by count
-            for m in L:
-                rep += "  {} [{}]\n".format(m[1], m[0])
-    rep += "\n"
+            self.neither_count += sign
+
+    def report(self, chars_by_field=False):
+        ''' Return the stats as a report string. If chars_by_field is True, the non-ASCII characters are also listed for each marker. '''
+        note = "  MDF defines homograph numbers as applying to lx (not se). Note: if you instead append a number to an se, the FLEx importer does understand that."
+        rep = [msg.format(HM, "entry [{}] near line {}".format(lxval, loc), note) for msg, lxval, loc in self.warnings]
+        rep.append("\n")
+
+        rep.append("Record count ({}): {}\n".format(RECORD_MARKER, self.rec_count))
+        rep.append("Entry count ({}): {}\n".format(self.entry_fields, self.entry_count))
+        rep.append("SFM markers (non-empty count , total count , name):\n")
+        for mkr, (total, nonempty) in sorted(self.mkrs.items(), key=lambda x: x[1][1]):  # sort by the non-empty count
+            rep.append("  {} , {} , {}\n".format(nonempty, total, mkr))
+        rep.append("\n")
+
+        rep.append("Checked (very roughly) the relative order of {} and {} (Having a mix of hierarchies is bad! Standard MDF has ps above one or more sn, but limiting it to one sn per ps imports better into FLEx. LT-9353 LT-10739):\n".format(PS, SN))
+        rep.append("  {} occurred first in {} records\n".format(PS, self.ps_first_count))
+        rep.append("  {} occurred first in {} records\n".format(SN, self.sn_first_count))
+        rep.append("  neither one occurred in {} records\n".format(self.neither_count))
+        rep.append("Checked roughly for missing {}; it is missing in {} records.\n".format(PS, self.ps_missing_count))
+        rep.append("In both cases, only checked records, not individual senses/subentries.\n")
+        rep.append("WARNING: If importing into FLEx, empty ps fields are a problem. If you have any, consider using find/replace to insert an explicit 'unknown' value (LT-10739, LT-14038).\n\n")
+
+        #TODO: consider removing the numbered code altogether, now that we have check_links()
+#        rep.append("Fields ending in numbers preceded by non-number(s):\n")
+#        if self.numbered:
+#            for mkr, count in sorted(self.numbered.items(), key=lambda x: x[1]):
+#                rep.append("  {} {}\n".format(count, mkr))
+#            rep.append("  If these are link fields these may be fragile links. Consider running a link/homograph checker.\n")
+#        else:
+#            rep.append("  None found. This suggests that there are no fragile links in this file. \n")
+#        rep.append("\n")
+
+        rep.append(self.chars.report(chars_by_field))
+
+        rep.append("Tallying values for specified fields... ({})\n".format(list(self.tally_fields)))
+        for f in self.tally_fields:
+            if self.values[f]:
+                rep.append("Tallied values for field {}: \n".format(f))
+                for val, count in sorted(self.values[f].items(), key=lambda x: x[0].casefold()):  # x[0] to sort by value; x[1] to sort by count
+                    rep.append("  {} [{}]\n".format(count, val))
+        rep.append("\n")
+
+        return ''.join(rep)
+
+def get_stats(recs, tally_fields=TALLY_FIELDS, entry_fields=ENTRY_FIELDS, markers=None, chars_by_field=False):
+    ''' Given an iterable of SFM records, compile stats about the SFM file. Return a report string.
     
-    return rep
+    If the reader's MarkerTable is passed in as markers, marker tests will use its MarkerSets (i.e. compare IDs where possible).
+    If chars_by_field is True, the report also lists the non-ASCII characters found in each marker (as -c does).
+    Assumptions:
+    - The markers will all be basic ASCII. Unicode characters beyond the ASCII will be tallied if found in the field values.
+    '''
+    stats = LexiconStats(tally_fields, entry_fields, markers)
+    for rec in recs:
+        stats.add(rec)
+    return stats.report(chars_by_field)
+
+def _stats_range(fname, start, end, recordmarker, tally_fields, entry_fields):
+    ''' Compile LexiconStats for the records between two byte offsets of the file. Runs in a worker process for
+    get_stats_parallel. Returns the stats (line numbers relative to the start of this range) and the number of
+    lines in the range.'''
+    with open(fname, 'rb') as infile:
+        infile.seek(start)
+        text = infile.read(end - start).decode('utf-8')
+    if '\r' in text:  #translate line endings, as SFMRecordReader does
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    reader = SFMRecordReader(text, recordmarker)
+    stats = LexiconStats(tally_fields, entry_fields, reader.markers)
+    for rec in reader:
+        stats.add(rec)
+    return stats, text.count('\n')
+
+def get_stats_parallel(fname, workers=None, recordmarker=RECORD_MARKER, tally_fields=TALLY_FIELDS, entry_fields=ENTRY_FIELDS, chars_by_field=False):
+    ''' Like get_stats, but for a whole (UTF-8) file, compiling the stats on several CPU cores at once. The file
+    is split into ranges of records (as for SFMParallelRecordReader); each worker process tallies its ranges,
+    and the partial stats are merged in file order, so the report is identical to get_stats'.
+    (Default: one worker per core.)
+    '''
+    workers = workers or os.cpu_count() or 1
+    header, ranges = record_ranges(fname, recordmarker, workers)
+    args = [(fname, start, end, recordmarker, tally_fields, entry_fields) for start, end in ranges]
+    stats = LexiconStats(tally_fields, entry_fields)
+    line = header.replace('\r\n', '\n').replace('\r', '\n').count('\n')  #how many lines precede the current range
+    if workers == 1 or len(args) < 2:
+        results = map(_stats_range, *zip(*args)) if args else []
+        for part, lines in results:
+            stats.merge(part.shift_lines(line))
+            line += lines
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            for part, lines in executor.map(_stats_range, *zip(*args)):
+                stats.merge(part.shift_lines(line))
+                line += lines
+    return stats.report(chars_by_field)
 
 class NumStripper:
     ''' A utility class for quickly stripping off numbers using precompiled regexes. Conceptually a singleton.'''
-    re_strip_sense_num = re.compile(r"\s+\d+$", flags = re.LOCALE | re.MULTILINE | re.UNICODE)
-    re_strip_hom_num = re.compile(r"\d+$", re.LOCALE | re.MULTILINE | re.UNICODE)
+    re_strip_sense_num = re.compile(r"\s+\d+$", flags = re.MULTILINE)  # (str patterns are always Unicode-aware; LOCALE is only for bytes)
+    re_strip_hom_num = re.compile(r"\d+$", re.MULTILINE)
 
     @classmethod
     def strip_sense_num(cls, val):
@@ -605,57 +1786,271 @@ class NumStripper:
                     return val2
         return val
 
-def build_indexes(recs, entry_fields=ENTRY_FIELDS, exclude_fields=[]):
-    ''' Given a list of records, return a dict for looking up each word form. Also return a dict
-    indexed on the stripped wordforms (i.e. without homograph numbers).
-
-    When testing link fields, you'll know the link is safe if the lookup returns a list of length 1.'''
+IndexEntry = namedtuple('IndexEntry', 'index location rec field marker hm')
+IndexEntry.__doc__ = ''' One indexed word form: the record's position in the list, its location (line number), the record
+itself, the position of the word's field within the record, that field's marker, and the value of the hm field
+that immediately follows it (or '').'''
+
+class LexiconIndex:
+    ''' An index of the word forms (lx and se, by default) in a list of records, for looking up link targets and
+    homographs. Build it once per run and share it among the checks that need it (check_links, etc.).
+
+    Each word form is indexed twice: exactly (with the number from an hm field immediately after it appended, as
+    the FLEx importer does), and stripped of any homograph/sense number (via NumStripper). Either lookup returns
+    a list of IndexEntry; a link is safe if the list has exactly one entry.
+    Citation forms (lc, lse by default) are indexed in the same two ways, but separately, so that they only match
+    when asked for. Records containing any of the exclude_fields (e.g. mn, for minor entries) are skipped.
+    If the reader's MarkerTable is passed in as markers, marker tests will use its MarkerSets (i.e. compare IDs where possible).
+    '''
 
-    #Outdated note: In the stripped case, we don't treat homograph numbers and senses as link unique-ifiers 
-    #because the FLEx importer doesn't reliably handle them (LT-10733).
+    def __init__(self, recs, entry_fields=ENTRY_FIELDS, citation_fields=CITATION_FIELDS, exclude_fields=(), markers=None):
+        self.recs = recs
+        self.entry_fields, self.citation_fields, self.exclude_fields = entry_fields, citation_fields, exclude_fields
+        self.exact, self.stripped = {}, {}  # key = word form (with or without homograph number); val = list of IndexEntry
+        self.citations, self.citations_stripped = {}, {}  # the same, for citation forms
+        self._strip = {}  # key = word form; val = the word form stripped of numbers (i.e. NumStripper's result, computed once)
+        if markers is not None:
+            entry_fields, citation_fields, exclude_fields = [markers.marker_set(x) for x in (entry_fields, citation_fields, exclude_fields)]
+        for i, rec in enumerate(recs):
+            if exclude_fields and rec.find(exclude_fields):  # e.g. a minor entry (the most typical exclusion)
+                continue
+            fields = rec.fields()
+            for j, (f, val) in enumerate(fields):
+                if f in entry_fields:
+                    exact, stripped = self.exact, self.stripped
+                elif f in citation_fields:
+                    exact, stripped = self.citations, self.citations_stripped
+                else:
+                    continue
+                val = val.strip() # just a whitespace strip; don't strip any numbers yet
+                hm = ''
+                if j+1 < len(fields) and fields[j+1][0] == HM: # is the next field \hm ?
+                    hm = fields[j+1][1].strip()
+                    val += hm  # append the homograph number
+                #TODO: ? Consider finding a homograph number that is lurking in a non-adjacent hm field.
+                #TODO: ??? Consider including a list of the sense numbers in explicit sn fields (for more precise checking)
+                entry = IndexEntry(i, rec.location, rec, j, f, hm)
+                exact.setdefault(val, []).append(entry)
+                stripped.setdefault(self.strip(val), []).append(entry)
+
+    def strip(self, val):
+        ''' Return the word form without whitespace or any homograph/sense number (see NumStripper.strip_hom_num). '''
+        try:
+            return self._strip[val]
+        except KeyError:
+            self._strip[val] = result = NumStripper.strip_hom_num(val)
+            return result
+
+    def lookup(self, val, citations=False):
+        ''' Return a list of the entries whose word form (with homograph number) is exactly val. With citations=True,
+        entries whose citation form is val are included too. '''
+        found = self.exact.get(val, [])
+        if citations and val in self.citations:
+            found = found + self.citations[val]
+        return found
+
+    def lookup_stripped(self, val, citations=False):
+        ''' Return a list of the entries whose word form matches val when both are stripped of homograph numbers. '''
+        val = self.strip(val)
+        found = self.stripped.get(val, [])
+        if citations and val in self.citations_stripped:
+            found = found + self.citations_stripped[val]
+        return found
+
+    def homographs(self):
+        ''' Yield (stripped word form, list of IndexEntry) for each word form shared by more than one entry. '''
+        for val, entries in self.stripped.items():
+            if len(entries) > 1:
+                yield val, entries
+
+    def links(self, link_fields=LINK_FIELDS):
+        ''' Yield (headword, record location, marker, line number, value) for each link field in each record. '''
+        return iter_links(self.recs, link_fields)
+
+    def record(self, entry):
+        ''' Return the entry's record. (For the same method of StoredLexiconIndex.) '''
+        return entry.rec
 
-    #TODO: Replace this with a class that just includes two ways of looking up a word (i.e. with or without homograph number),
-    # and can return just the values that specifically match or else all values that could confuse the FLEx importer.
-    # Store (in the index) pointers to the actual SFMRecord objects? I.e. so the calling code can fix them.
+def build_indexes(recs, entry_fields=ENTRY_FIELDS, exclude_fields=[]):
+    ''' Given a list of records, return a dict for looking up each word form. Also return a dict
+    indexed on the stripped wordforms (i.e. without homograph numbers). Each value is a list of [index, location, record].
+
+    When testing link fields, you'll know the link is safe if the lookup returns a list of length 1.
+    (Kept for older scripts; new code should use a LexiconIndex.)'''
+    index = LexiconIndex(recs, entry_fields, (), exclude_fields)
+    entries, entries_stripped = defaultdict(list), defaultdict(list)  # (as before, looking up a missing word gives an empty list)
+    for lookup, d in ((entries, index.exact), (entries_stripped, index.stripped)):
+        for val, found in d.items():
+            lookup[val] = [[e.index, e.location, e.rec] for e in found]
+    return entries, entries_stripped
 
-    entries = defaultdict(lambda: list([]))  # key is a word (lx or se), value is a list (index, location in file)
-    entries_stripped = defaultdict(lambda: list([]))  # key is a word (lx or se), value is a list (index, location in file)
 
-    i = 0
+def iter_links(recs, link_fields=LINK_FIELDS):
+    ''' Yield (headword, record location, marker, line number, value) for each link field in each record. '''
     for rec in recs:
-        fields = rec.as_lists()
-        j = 0
-        if not rec.find_first(exclude_fields):  # e.g. if not a minor entry (the most typical exclusion)
-            for f, val in fields:
-                if f in entry_fields:
-                    val = val.strip() # just a whitespace strip; don't strip any numbers yet
-                    if j+1 < len(fields) and fields[j+1][0] == HM: # is the next field \hm ?
-                        val += fields[j+1][1].strip()  # append the homograph number
-                    #TODO: ? Consider finding a homograph number that is lurking in a non-adjacent hm field.
-                    #TODO: ?? Consider splitting out se's
-                    #TODO: ??? Consider including a list of the sense numbers in explicit sn fields (for more precise checking)
-                    entries[val].append([i, rec.location, rec])
-                    val_s = NumStripper.strip_hom_num(val)
-                    entries_stripped[val_s].append([i, rec.location, rec])
-                j += 1
-        i += 1
-    return entries, entries_stripped
+        L = rec.fields()
+        lxval = L[0][1].strip()
+        for j, (f, val) in enumerate(L):
+            if f in link_fields:
+                yield lxval, rec.location, f, rec.line_number(j), val.strip()
+
+StoredIndexEntry = namedtuple('StoredIndexEntry', 'index location start end field marker hm')
+StoredIndexEntry.__doc__ = ''' Like IndexEntry, but for a StoredLexiconIndex: instead of the record itself, it has the byte offsets
+of the record's start and end in the file (see StoredLexiconIndex.record).'''
 
+class StoredLexiconIndex:
+    ''' A LexiconIndex saved next to the SFM file (as fname plus INDEX_EXT, an SQLite database), so that later runs
+    can look up headwords, homographs and links without re-parsing the file. Use open_lexicon_index to get one;
+    it checks the file's fingerprint (path, size, modification time, and if need be a hash of its contents), and
+    rebuilds the index only if the file has changed.
 
-def check_links(recs, link_fields=LINK_FIELDS, entry_fields=ENTRY_FIELDS, variant_fields=VARIANT_LINK_FIELDS):
+    It has the same lookup methods as LexiconIndex, but returns StoredIndexEntry. It also stores the values of the
+    link fields (for check_links). Only lookups that need a whole record (see record()) read the file again, and
+    then only that record, by seeking to its byte offset.
+    '''
+    SETTINGS = ('recordmarker', 'entry_fields', 'citation_fields', 'exclude_fields', 'link_fields')
+
+    def __init__(self, fname, db):
+        self.fname = fname
+        self.db = db
+        meta = dict(db.execute('SELECT name, value FROM meta'))
+        self.recordmarker = meta['recordmarker']
+        self.entry_fields, self.citation_fields, self.exclude_fields, self.link_fields = [tuple(json.loads(meta[x])) for x in self.SETTINGS[1:]]
+        self._strip = {}  # key = word form; val = the word form stripped of numbers (i.e. NumStripper's result, computed once)
+
+    def close(self):
+        self.db.close()
+
+    def strip(self, val):
+        ''' Return the word form without whitespace or any homograph/sense number (see NumStripper.strip_hom_num). '''
+        try:
+            return self._strip[val]
+        except KeyError:
+            self._strip[val] = result = NumStripper.strip_hom_num(val)
+            return result
+
+    def _entries(self, column, val, citations):
+        sql = 'SELECT rec, location, start, end, field, marker, hm FROM entries WHERE {} = ? AND citation <= ? ORDER BY citation, rowid'.format(column)
+        return [StoredIndexEntry(*row) for row in self.db.execute(sql, (val, int(citations)))]
+
+    def lookup(self, val, citations=False):
+        ''' Return a list of the entries whose word form (with homograph number) is exactly val. With citations=True,
+        entries whose citation form is val are included too. '''
+        return self._entries('form', val, citations)
+
+    def lookup_stripped(self, val, citations=False):
+        ''' Return a list of the entries whose word form matches val when both are stripped of homograph numbers. '''
+        return self._entries('stripped', self.strip(val), citations)
+
+    def homographs(self):
+        ''' Yield (stripped word form, list of StoredIndexEntry) for each word form shared by more than one entry. '''
+        rows = self.db.execute('SELECT stripped FROM entries WHERE citation = 0 GROUP BY stripped HAVING count(*) > 1 ORDER BY min(rowid)').fetchall()
+        for (val,) in rows:
+            yield val, self._entries('stripped', val, False)
+
+    def links(self, link_fields=LINK_FIELDS):
+        ''' Yield (headword, record location, marker, line number, value) for each link field in each record, as iter_links does. '''
+        if isinstance(link_fields, MarkerSet):
+            link_fields = link_fields.names()
+        missing = set(link_fields) - set(self.link_fields)
+        if missing:
+            raise ValueError('The index does not include the link fields {}.'.format(sorted(missing)))
+        sql = 'SELECT headword, location, marker, line, value FROM links WHERE marker IN ({}) ORDER BY rowid'.format(','.join('?' * len(link_fields)))
+        yield from self.db.execute(sql, tuple(link_fields))
+
+    def record(self, entry):
+        ''' Return the entry's whole record (an SFMRecord), read from the file by seeking to its byte offset. '''
+        with open(self.fname, 'rb') as infile:
+            infile.seek(entry.start)
+            rec = next(SFMRecordReader(infile.read(entry.end - entry.start), self.recordmarker, errors='strict'))
+        rec.location = entry.location
+        return rec
+
+def file_hash(fname, chunk_size=1<<20):
+    ''' Return a hex digest of the file's contents. '''
+    h = hashlib.blake2b()
+    with open(fname, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _build_stored_index(fname, dbname, settings):
+    ''' Parse the file and save its LexiconIndex (and link fields) to a new SQLite database. '''
+    with open(fname, 'rb') as infile:
+        data = infile.read()
+    recs = list(SFMBytesRecordReader(data, settings['recordmarker']))
+    index = LexiconIndex(recs, settings['entry_fields'], settings['citation_fields'], settings['exclude_fields'])
+    rows = [(e.index, e.location, recs[e.index]._starts[0], recs[e.index]._end, e.field, e.marker, e.hm, citation, form, index.strip(form))
+            for citation, forms in enumerate((index.exact, index.citations)) for form, entries in forms.items() for e in entries]
+    rows.sort(key=lambda row: (row[0], row[4]))  # record order
+    tmp = dbname + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    db = sqlite3.connect(tmp)
+    try:
+        db.execute('CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)')
+        db.execute('CREATE TABLE entries (rec INTEGER, location INTEGER, start INTEGER, end INTEGER, field INTEGER, marker TEXT, hm TEXT, citation INTEGER, form TEXT, stripped TEXT)')
+        db.execute('CREATE TABLE links (headword TEXT, location INTEGER, marker TEXT, line INTEGER, value TEXT)')
+        db.executemany('INSERT INTO entries VALUES (?,?,?,?,?,?,?,?,?,?)', rows)
+        db.executemany('INSERT INTO links VALUES (?,?,?,?,?)', iter_links(recs, settings['link_fields']))
+        db.execute('CREATE INDEX entries_form ON entries (form)')
+        db.execute('CREATE INDEX entries_stripped ON entries (stripped)')
+        db.executemany('INSERT INTO meta VALUES (?,?)', settings.items())
+        db.commit()
+    finally:
+        db.close()
+    os.replace(tmp, dbname)  # (atomic, so an interrupted run can't leave a half-written index)
+
+def open_lexicon_index(fname, recordmarker=RECORD_MARKER, entry_fields=ENTRY_FIELDS, citation_fields=CITATION_FIELDS, exclude_fields=(),
+                       link_fields=LINK_FIELDS + VARIANT_LINK_FIELDS, rebuild=False):
+    ''' Return a StoredLexiconIndex for the (UTF-8) SFM file, loading the one saved next to it if it's still current,
+    and otherwise (or if rebuild is True) building and saving a new one.
+
+    The saved index is current if it was built with the same settings, and the file has the same path, size and
+    modification time as when it was built. If only the path or modification time differ (e.g. the file was
+    copied or touched), the file's contents are hashed and compared instead; if they match, the index is reused.
+    '''
+    dbname = fname + INDEX_EXT
+    st = os.stat(fname)
+    settings = {'version': str(INDEX_VERSION), 'recordmarker': recordmarker}
+    settings.update((name, json.dumps(list(val))) for name, val in
+                    zip(StoredLexiconIndex.SETTINGS[1:], (entry_fields, citation_fields, exclude_fields, link_fields)))
+    fingerprint = {'path': os.path.abspath(fname), 'size': str(st.st_size), 'mtime': str(st.st_mtime_ns)}
+    if not rebuild and os.path.exists(dbname):
+        db = sqlite3.connect(dbname)
+        try:
+            meta = dict(db.execute('SELECT name, value FROM meta'))
+        except sqlite3.DatabaseError:
+            meta = {}
+        if all(meta.get(k) == v for k, v in settings.items()) and meta.get('size') == fingerprint['size']:
+            if all(meta.get(k) == v for k, v in fingerprint.items()):
+                return StoredLexiconIndex(fname, db)
+            if meta.get('hash') == file_hash(fname):
+                db.executemany('UPDATE meta SET value = ? WHERE name = ?', [(v, k) for k, v in fingerprint.items()])
+                db.commit()
+                return StoredLexiconIndex(fname, db)
+        db.close()
+    settings.update(fingerprint)
+    settings['hash'] = file_hash(fname)
+    _build_stored_index(fname, dbname, settings)
+    return StoredLexiconIndex(fname, sqlite3.connect(dbname))
+
+def check_links(recs, link_fields=LINK_FIELDS, entry_fields=ENTRY_FIELDS, variant_fields=VARIANT_LINK_FIELDS, markers=None, index=None):
     ''' For each link field in each record, check whether the link's target exists and is totally unique. 
     
+    If the reader's MarkerTable is passed in as markers, marker tests will use its MarkerSets (i.e. compare IDs where possible).
+    To share one LexiconIndex of the records with other checks, pass it in as index (it must index entry_fields).
+    Or, pass in a StoredLexiconIndex (see open_lexicon_index) and None for recs, to check the links without the records.
     Limitation: For sense-specific links, doesn't check whether that numbered sense actually exists.
     Limitation: Won't complain about a link to "abba2" if only a single "abba" entry exists.'''
 
-    #TODO: incorporate homograph numbers from hm fields
     #TODO: check citation form fields (lc, lse) in addition to lexeme form fields (lx, se)
 
-    def check_link(val, entries, snippet):
-        ''' Return an empty string if the link is ok. Otherwise, return an error/warning message. '''
+    def check_link(found, snippet):
+        ''' Given the entries found for a link, return an empty string if the link is ok. Otherwise, return an error/warning message. '''
         msg = None
-        if val in entries and entries[val]:
-            if len(entries[val]) > 1:
+        if found:
+            if len(found) > 1:
                 msg = "ERROR: ambiguous link (multiple matches) in {}\n".format(snippet)
             else:
                 pass # link is good
@@ -665,44 +2060,38 @@ def check_links(recs, link_fields=LINK_FIELDS, entry_fields=ENTRY_FIELDS, varian
     
     good, bad, unsure = 0, 0, 0  # counters
     rep = '\nChecking links...  (for link fields {} targeting {})\n'.format(link_fields, entry_fields)
-    entries, entries_stripped = build_indexes(recs, entry_fields)
+    if markers is not None:
+        link_fields, entry_fields, variant_fields = [markers.marker_set(x) for x in (link_fields, entry_fields, variant_fields)]
+    if index is None:
+        index = LexiconIndex(recs, entry_fields, markers=markers)
     
-    for rec in recs:
-        L = rec.as_lists()
-        lxval = L[0][1].strip()
-        loc = rec.location
-        j = 0
-        for f, val in L:
-            if f in link_fields:
-                val = val.strip()
-                val_s = NumStripper.strip_hom_num(val)
-                snippet = "record ({}), which is near line {}; link in field {} (line {}?) pointing to target ({}).".format(lxval, loc, f, loc + j, val)
-                msg_s = check_link(val_s, entries_stripped, snippet)
-                if msg_s:
-                    msg = check_link(val, entries, snippet) # re-check, non-stripped
-                    if msg:  # still not clearly a good link
-                        if val == val_s:
-                            rep += msg_s
-                        else:
-                            rep += msg
-                        bad += 1
-                    else:
-                        pass # the FLEx bug mentioned below has now been fixed
-                        #rep += "POTENTIAL " + msg_s + " Actually, this is probably not a data error; might be problem for FLEx import, but only if homographs aren't numbered 'normally'. (LT-10733)\n"
-                        #unsure += 1
+    links = index.links(link_fields) if recs is None else iter_links(recs, link_fields)
+    for lxval, loc, f, line, val in links:
+        val_s = index.strip(val)
+        snippet = "record ({}), which is near line {}; link in field {} (line {}) pointing to target ({}).".format(lxval, loc, f, line, val)
+        msg_s = check_link(index.lookup_stripped(val_s), snippet)
+        if msg_s:
+            msg = check_link(index.lookup(val), snippet) # re-check, non-stripped
+            if msg:  # still not clearly a good link
+                if val == val_s:
+                    rep += msg_s
                 else:
-                    good += 1
-                    # The link is good. Now, check whether the targeted variant says I am its variant (circular)
-                    if f in variant_fields:
-                        if val in entries and entries[val]:
-                            for _m, _n, entry in entries[val]:
-                                for backref in entry.find_values(variant_fields):
-                                    if NumStripper.strip_hom_num(backref) == NumStripper.strip_hom_num(lxval):
-                                        rep += "VARIANT ERROR: entries {} and {} each refer to the other as the variant.\n".format(lxval, entry.as_lists()[0][1])
-                                
-                    
-            j += 1
-                
+                    rep += msg
+                bad += 1
+            else:
+                pass # the FLEx bug mentioned below has now been fixed
+                #rep += "POTENTIAL " + msg_s + " Actually, this is probably not a data error; might be problem for FLEx import, but only if homographs aren't numbered 'normally'. (LT-10733)\n"
+                #unsure += 1
+        else:
+            good += 1
+            # The link is good. Now, check whether the targeted variant says I am its variant (circular)
+            if f in variant_fields:
+                for target in index.lookup(val):
+                    target = index.record(target)
+                    for backref in target.find_values(variant_fields):
+                        if index.strip(backref) == index.strip(lxval):
+                            rep += "VARIANT ERROR: entries {} and {} each refer to the other as the variant.\n".format(lxval, target.field(0)[1])
+
     rep += "Problematic (ambiguous or broken) links: {}\nClearly good links: {}\n".format(bad, good)
     #rep += "Problematic (ambiguous or broken) links: {}\nPossibly ambiguous (only for FLEx import) if homograph numbering/sorting isn't 'optimal' (bug LT-10733): {}\nClearly good links: {}\n".format(bad, unsure, good)
     
@@ -711,25 +2100,60 @@ def check_links(recs, link_fields=LINK_FIELDS, entry_fields=ENTRY_FIELDS, varian
 def execute(args):
     ''' Being run as a script, so run diagnostics on the SFM file. '''
     print('Enter SFMTools.py -h to learn the command line options.')
-    print('Starting... Verifying that the whole file is unicode (UTF-8)...')
+    print('Starting... Reading the file and verifying that it is all unicode (UTF-8)...')
     in_fname = args['infile']
     out_fname = args['outfile']
     if not out_fname:
         out_fname = in_fname + OUTFILE_EXT
-    tmp = bad_encoding(in_fname, 'utf-8')
-    if tmp:
-        print('Aborted. (Can only process SFM files that are UTF-8 unicode.)')
-        print(tmp)
+
+    by_field = args.get('chars_by_field')
+
+    def save_stats(report):
+        with open (out_fname, mode='w', encoding='utf-8-sig') as outfile:
+            outfile.write("Checking file {}... Verified that the whole file can be read in as unicode (UTF-8).\n".format(out_fname))
+            outfile.write(report)
+        print(ascii(report))
+        print('Done. Output saved to this file: {}'.format(out_fname))
+
+    if args.get('stats') and args.get('workers') != 1 and not args['chars']:
+        # The worker processes each read and parse their own part of the file, so it isn't parsed here at all.
+        try:
+            report = get_stats_parallel(in_fname, args['workers'], chars_by_field=by_field)
+        except UnicodeDecodeError as e:
+            print('Aborted. (Can only process SFM files that are UTF-8 unicode.)')
+            print(e.reason)
+            return
+        save_stats(report)
         return
-    
-    with open(in_fname, encoding='utf-8') as infile:
-        sfm_records = SFMRecordReader(infile)
-        sfm_records = list(sfm_records)  # load entire file into memory
+
+    with open(in_fname, mode='rb') as infile:  # read just once; the reader decodes and checks the encoding as it goes
+        try:
+            sfm_records = SFMRecordReader(infile, errors='strict')
+        except UnicodeDecodeError as e:
+            print('Aborted. (Can only process SFM files that are UTF-8 unicode.)')
+            print(e.reason)
+            return
+        markers = sfm_records.markers
+        if args['chars']:
+            with open (out_fname, mode='w', encoding='utf-8-sig') as outfile:
+                outfile.write(char_inventory(sfm_records).report())
+            print('Done. Output saved to this file: {}'.format(out_fname))
+            return
+        if args.get('stats'):
+            save_stats(get_stats(sfm_records, markers=markers, chars_by_field=by_field))  # (one record at a time; no need to keep them)
+            return
+        sfm_records = list(sfm_records)  # load entire file into memory (the checks below need every record)
         with open (out_fname, mode='w', encoding='utf-8-sig') as outfile:  # The -sig includes a BOM, for explicit unicode
             outfile.write("Checking file {}... Verified that the whole file can be read in as unicode (UTF-8).\n".format(out_fname))
-            report = get_stats(sfm_records)
+            report = get_stats(sfm_records, markers=markers, chars_by_field=by_field)
             outfile.write(report)
-            report2 = check_links(sfm_records)
+            if args['index']:
+                index = open_lexicon_index(in_fname)
+                report2 = check_links(None, markers=markers, index=index)
+                index.close()
+            else:
+                index = LexiconIndex(sfm_records, markers=markers)  # shared by the checks that look up entries
+                report2 = check_links(sfm_records, markers=markers, index=index)
             outfile.write(report2)
             report3 = "\nTrying to check numbering of senses/subsenses: delegating the task to SFMSenseNum.py...\n"
             try:
@@ -1,6 +1,9 @@
 import unittest
-import io
-from SfmToolsJC import *
+import io, os, re, json, tempfile
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from SFMTools import *
+import SFMTools, ApplyRE
 
 #Note: some of the following strings will be cast as streams so the readers
 #can treat them like files.
@@ -31,6 +34,42 @@ definition.
 str02f = ["lx","\n"]
 str02f2 = ["zx", " zz\n\n"]
 
+lexicon = str02 + '\\lx c\n\\ps n\n\\hm 2\n\\ge dé\n\n\\lx d\n\\se c 2\n\\ge gloss of d\n\\de é\n\n'
+
+def make_regexes():
+    return [ApplyRE.RegExpression('gloss', 'GLOSS', 'sfmval ge'), ApplyRE.RegExpression('é', 'e', 'sfmval'),
+            ApplyRE.RegExpression(r'\n\n+', r'\n', 'broad: record'), ApplyRE.RegExpression('GLOSS', 'Gloss', 'broad')]
+
+regex_config = r'''{ The same regexes as make_regexes, as an ApplyRE config file.
+}}
+
+Record marker: lx
+## narrow
+sfmval ge
+gloss
+GLOSS
+## narrow, any field
+sfmval
+é
+e
+## broad, record-local
+broad: record
+\n\n+
+\n
+## broad
+broad
+GLOSS
+Gloss
+'''
+
+def apply_serially(regexes, data):
+    for group in ApplyRE.group_regexes(regexes):
+        if group[0].narrow:
+            data, _counts = ApplyRE.apply_narrow_chain(group, data)
+        else:
+            data, _counts = ApplyRE.apply_broad(group, data)
+    return data
+
 
 class TestFieldReader(unittest.TestCase):
     def test_header(self):
@@ -46,6 +85,349 @@ class TestFieldReader(unittest.TestCase):
         self.assertEqual(f, str02f2)
 
 
+class TestBufferReader(unittest.TestCase):
+    def test_header(self):
+        r = SFMBufferReader(io.StringIO(str01))
+        self.assertEqual(r.header, str01h)
+
+    def test_same_as_field_reader(self):
+        for s in (str01, str02, '\ufeff' + str02):
+            a, b = SFMFieldReader(io.StringIO(s)), SFMBufferReader(io.StringIO(s))
+            self.assertEqual(a.header, b.header)
+            self.assertEqual(list(a), list(b))
+
+
+class TestRecordView(unittest.TestCase):
+    def test_same_as_record(self):
+        a, b = list(SFMRecordReader(str02)), list(SFMLazyRecordReader(str02))
+        self.assertEqual([r.as_string() for r in a], [r.as_string() for r in b])
+        self.assertEqual(a[1].find(['xv', 'xe'], 2), b[1].find(['xv', 'xe'], 2))
+        self.assertEqual(a[1].find_values(['de']), b[1].find_values(['de']))
+        self.assertEqual([r.as_lists() for r in a], [r.as_lists() for r in b])
+
+    def test_compact(self):
+        a, b = list(SFMRecordReader(lexicon)), list(SFMLazyRecordReader(lexicon, compact=True))
+        self.assertEqual([(r.location, r.as_string(), r.fields()) for r in a], [(r.location, r.as_string(), r.fields()) for r in b])
+        self.assertEqual([r._data for r in b], [r.as_string() for r in a])  # (each has just its own text, not the whole buffer)
+        self.assertEqual(b[1]._starts.typecode, 'H')
+
+    def test_last_record(self):
+        data = '\\lx aba\n\\cf kotu\n\n\\lx kotu\n'  # the last record is just its \\lx field
+        a = list(SFMRecordReader(data))
+        for reader in (SFMLazyRecordReader(data), SFMLazyRecordReader(data, compact=True)):
+            b = list(reader)
+            self.assertEqual([r.as_string() for r in a], [r.as_string() for r in b])
+            self.assertEqual([r.fields() for r in a], [r.fields() for r in b])
+
+    def test_bytes(self):
+        a, b = list(SFMLazyRecordReader(str02)), list(SFMBytesRecordReader(str02.encode('utf-8')))
+        self.assertEqual([r.as_string() for r in a], [r.as_string() for r in b])
+        self.assertEqual([r.fields() for r in a], [r.fields() for r in b])
+        bad = list(SFMBytesRecordReader(b'\\lx a\n\\ge \xff\n'))[0]
+        self.assertEqual(bad.field(0), ('lx', 'a\n'))
+        with self.assertRaises(UnicodeDecodeError) as cm:
+            bad.field(1)
+        self.assertEqual(cm.exception.start, 10)
+
+
+class TestRecord(unittest.TestCase):
+    def test_interned_markers(self):
+        for reader in (SFMRecordReader(lexicon), SFMLazyRecordReader(lexicon)):
+            recs = list(reader)
+            ge = [mkr for rec in recs for mkr, _value in rec.as_lists() if mkr == 'ge']
+            self.assertTrue(len(ge) == 3 and all(mkr is ge[0] for mkr in ge))
+            self.assertEqual(list(recs[2].marker_ids()), [reader.markers.intern(m) for m in ('lx', 'ps', 'hm', 'ge')])
+            both = reader.markers.marker_set(['hm', 'ge'])
+            self.assertTrue('ge' in both and reader.markers.intern('ge') in both)
+            self.assertEqual(recs[2].find(both), recs[2].find(['hm', 'ge']))
+
+    def test_cached_string(self):
+        text = '\\lx a\n\\de  two  spaces\n\n'
+        rec = SFMRecord(['\\lx a\n', '\\de  two  spaces\n\n'])
+        self.assertFalse(rec.is_modified())
+        self.assertEqual(rec.as_string(), text)
+        rec.find(['de'])
+        rec.fields()
+        self.assertFalse(rec.is_modified())  # (reading doesn't count)
+        rec.set_value(1, 'one\n')
+        self.assertTrue(rec.is_modified())
+        self.assertEqual(rec.as_string(), '\\lx a\n\\de one\n')
+        rec = SFMRecord(['\\lx a \n'])  # (doesn't round-trip, so it's rebuilt as before)
+        self.assertTrue(rec.is_modified())
+        self.assertEqual(rec.as_string(), '\\lx a \n')
+        rec = SFMRecord(['\\lx a\n'])
+        rec.as_lists()[0][1] = 'b\n'
+        self.assertEqual(rec.as_string(), '\\lx b\n')
+
+    def test_renamed_in_place(self):
+        rec = SFMRecord(['\\lx a\n'] + ['\\ge g{}\n'.format(i) for i in range(INDEX_MIN_FIELDS)] + ['\\sd x\n'])
+        self.assertEqual(rec.find(['sd']), [('sd', INDEX_MIN_FIELDS + 1)])  # (builds the marker index)
+        for field in rec.as_lists():
+            if field[0] == 'sd': field[0] = 'so'
+        self.assertEqual(rec.find(['so']), [('so', INDEX_MIN_FIELDS + 1)])
+        self.assertEqual(rec.find_first('so'), ['so', 'x\n'])
+
+
+class TestParallelReader(unittest.TestCase):
+    def test_crlf(self):
+        with tempfile.TemporaryDirectory() as folder:
+            fname = os.path.join(folder, 'lexicon.txt')
+            with open(fname, 'w', encoding='utf-8', newline='\r\n') as outfile:
+                outfile.write(str02)
+            with open(fname, encoding='utf-8') as infile:
+                a = SFMLazyRecordReader(infile)
+            b = SFMParallelRecordReader(fname, workers=1)
+            self.assertEqual(a.header, b.header)
+            self.assertEqual([(r.location, r.as_string()) for r in a], [(r.location, r.as_string()) for r in b])
+
+
+class TestLocation(unittest.TestCase):
+    def test_exact_lines(self):
+        data = '\\_sh v3.0\n\\lx a\nmore\n\\ge b\n\\lx c\n\\ge d'
+        for reader in (SFMRecordReader(data), SFMRecordReader(data, field_reader=SFMBufferReader), SFMLazyRecordReader(data)):
+            recs = list(reader)
+            self.assertEqual([r.location for r in recs], [2, 5])
+            self.assertEqual([recs[0].line_number(1), recs[1].line_number(1)], [4, 6])
+
+    def test_any_order(self):
+        for data in (lexicon, lexicon.encode('utf-8')):
+            r = SFMBufferReader(data)
+            list(r)  # (the reader has counted up to the end)
+            offsets = range(len(data) - 1, -1, -7)
+            newline = b'\n' if isinstance(data, bytes) else '\n'
+            self.assertEqual([r.line_number(i) for i in offsets], [data.count(newline, 0, i) + 1 for i in offsets])
+
+
+class TestEncoding(unittest.TestCase):
+    def test_decode_checked(self):
+        self.assertEqual(decode_checked(b'ab\n\xe2\x82c\n\xff', 'replace'), ('ab\n\ufffdc\n\ufffd', [(2, 3), (3, 7)]))
+        self.assertRaises(UnicodeDecodeError, SFMRecordReader, b'\\lx a\n\\ge \xff\n', errors='strict')
+
+
+class TestDelta(unittest.TestCase):
+    def test_round_trip(self):
+        old = str02 + '\\lx c\n\\ge d\n\n\\lx e\n'
+        new = old.replace('\\ge d', '\\ge D').replace('\\lx e\n', '') + '\\lx f\n'
+        unchanged = SFMDeltaWriter(io.StringIO(old), io.StringIO(newline=''), window=2, chunk_size=5)
+        unchanged.write(old)
+        self.assertEqual(unchanged.finish(), 0)
+        patch, out = io.StringIO(newline=''), io.StringIO()
+        writer = SFMDeltaWriter(io.StringIO(old), patch)
+        writer.write(new)
+        self.assertEqual(writer.finish(), 1)
+        self.assertTrue(patch.getvalue().startswith(DELTA_HEADER + '\n@@ 18 4 -19 +19\n'))
+        patch.seek(0)
+        apply_delta(io.StringIO(old), patch, out)
+        self.assertEqual(out.getvalue(), new)
+        patch.seek(0)
+        self.assertRaises(Exception, apply_delta, io.StringIO(new), patch, io.StringIO())
+
+
+class TestStats(unittest.TestCase):
+    def test_merge_remove(self):
+        recs = list(SFMRecordReader(io.StringIO(str02 + '\\lx c\n\\ps n\n\\hm 2\n\\ge dé\n')))
+        whole, first, second = LexiconStats(), LexiconStats(), LexiconStats()
+        for rec in recs:
+            whole.add(rec)
+        first.add(recs[0])
+        second.add(recs[1])
+        second.add(recs[2])
+        self.assertEqual(first.merge(second).report(), whole.report())
+        self.assertEqual(whole.report(), get_stats(recs))
+        whole.remove(recs[2])
+        self.assertEqual(whole.report(), get_stats(recs[:2]))
+
+    def test_chars(self):
+        recs = list(SFMRecordReader(lexicon))
+        one_by_one = CharInventory()
+        for rec in recs:
+            one_by_one.add(rec)
+        self.assertEqual(char_inventory(recs).counts, one_by_one.counts)
+        self.assertEqual(one_by_one.counts, {'ge': {'é': 1}, 'de': {'é': 1}})
+        report = get_stats(recs)
+        self.assertTrue(one_by_one.report(by_field=False) in report)
+        self.assertFalse('by field' in report)
+        self.assertTrue(one_by_one.report() in get_stats(recs, chars_by_field=True))
+
+    def test_char_order(self):
+        # Characters with equal counts are listed in the order first seen, as get_stats always has (not by code point).
+        recs = list(SFMRecordReader('\\lx ŋa\n\\ge ṭé\n\n\\lx b\n\\de é ŋ\n'))
+        expected = ("  1 , ṭ , \\u1e6d , LATIN SMALL LETTER T WITH DOT BELOW\n"
+                    "  2 , ŋ , \\u014b , LATIN SMALL LETTER ENG\n"
+                    "  2 , é , \\xe9 , LATIN SMALL LETTER E WITH ACUTE\n")
+        self.assertTrue(" count , char , code point , name\n" + expected + "\n" in get_stats(recs))
+        first, second = LexiconStats(), LexiconStats()
+        first.add(recs[0])
+        second.add(recs[1])
+        self.assertEqual(first.merge(second).report(), get_stats(recs))
+
+    def test_parallel(self):
+        chunk_min, SFMTools.PARALLEL_CHUNK_MIN = SFMTools.PARALLEL_CHUNK_MIN, 40  # (so that even this little file gets split)
+        try:
+            with tempfile.TemporaryDirectory() as folder:
+                fname = os.path.join(folder, 'lexicon.txt')
+                for newline in ('\n', '\r\n'):
+                    with open(fname, 'w', encoding='utf-8', newline=newline) as outfile:
+                        outfile.write(lexicon * 3)
+                    self.assertGreater(len(record_ranges(fname, workers=2)[1]), 2)
+                    with open(fname, encoding='utf-8') as infile:
+                        expected = get_stats(SFMRecordReader(infile))
+                    self.assertEqual(get_stats_parallel(fname, 1), expected)
+                    self.assertEqual(get_stats_parallel(fname, 2), expected)
+        finally:
+            SFMTools.PARALLEL_CHUNK_MIN = chunk_min
+
+
+class TestIndex(unittest.TestCase):
+    def test_lookups(self):
+        recs = list(SFMRecordReader(io.StringIO('\\lx aba\n\\hm 2\n\\lc Aba\n\n\\lx aba1\n\\se kotu 3\n\n\\lx mi\n\\mn aba\n')))
+        index = LexiconIndex(recs, exclude_fields=['mn'])
+        self.assertEqual([e.hm for e in index.lookup('aba2')], ['2'])
+        self.assertEqual([e.index for e in index.lookup_stripped('aba3')], [0, 1])
+        self.assertEqual([e.marker for e in index.lookup_stripped('kotu')], ['se'])
+        self.assertEqual(index.lookup('Aba'), [])
+        self.assertEqual(len(index.lookup('Aba', citations=True)), 1)
+        self.assertEqual(index.lookup('mi'), [])
+        self.assertEqual([w for w, _entries in index.homographs()], ['aba'])
+        entries, entries_stripped = build_indexes(recs, exclude_fields=['mn'])
+        self.assertEqual([e[0] for e in entries_stripped['aba']], [0, 1])
+        self.assertEqual(entries['mi'], [])  # (SFMMinor.py relies on missing words giving an empty list)
+
+    def test_stored(self):
+        data = '\\lx aba\n\\hm 2\n\\cf kotu\n\n\\lx kotu\n\\cf aba2\n\\cf mi\n'
+        with tempfile.TemporaryDirectory() as folder:
+            fname = os.path.join(folder, 'lexicon.txt')
+            with open(fname, 'w', encoding='utf-8') as outfile:
+                outfile.write(data)
+            recs = list(SFMRecordReader(data))
+            index = open_lexicon_index(fname)
+            self.assertEqual(check_links(None, index=index), check_links(recs))
+            self.assertEqual(index.record(index.lookup('kotu')[0]).as_string(), recs[1].as_string())
+            index.close()
+            index = open_lexicon_index(fname)  # reloaded, not rebuilt
+            self.assertEqual([e.start for e in index.lookup_stripped('aba')], [0])
+            index.close()
+            with open(fname, 'w', encoding='utf-8') as outfile:
+                outfile.write('\\lx aba\n\\cf kotu\n\n\\lx kotu\n')
+            index = open_lexicon_index(fname)
+            self.assertEqual(index.record(index.lookup('kotu')[0]).as_string(), '\\lx kotu\n')
+            index.close()
+
+
+class TestApplyRE(unittest.TestCase):
+    def test_streaming(self):
+        expected = apply_serially(make_regexes(), lexicon)
+        for regexes in (make_regexes(), make_regexes()[:3]):  # (without the last one, nothing needs the whole file)
+            for chunk_size in (5, 40, 1 << 20):
+                out = io.StringIO()
+                ApplyRE.apply_streaming(regexes, io.StringIO(lexicon), out, chunk_size=chunk_size)
+                self.assertEqual(out.getvalue(), apply_serially(regexes, lexicon))
+        self.assertTrue('Gloss of d' in expected and 'de e' in expected)
+
+    def test_cache(self):
+        expected = apply_serially(make_regexes()[:3], lexicon)
+        with tempfile.TemporaryDirectory() as folder:
+            fname = os.path.join(folder, 'lexicon.txt' + ApplyRE.CACHE_EXT)
+            for run in range(2):
+                cache = ApplyRE.RecordCache(fname)
+                self.assertEqual(ApplyRE.apply_cached(make_regexes()[:3], lexicon, cache=cache)[0], expected)
+                self.assertTrue(cache.misses == 0 if run else cache.hits == 0)
+                cache.save()
+            for junk in (b'\x80\x04not json', b'{"version": %d, "entries": {"k": [1, 2]}}' % ApplyRE.CACHE_VERSION):
+                with open(fname, 'wb') as outfile:
+                    outfile.write(junk)
+                cache = ApplyRE.RecordCache(fname)
+                self.assertEqual(ApplyRE.apply_cached(make_regexes()[:3], lexicon, cache=cache)[0], expected)
+                self.assertEqual(cache.hits, 0)
+
+    def test_narrow_chain(self):
+        # The third regex starts a new field, which the fourth should then see (as it would after a re-parse).
+        regexes = make_regexes()[:2] + [ApplyRE.RegExpression(r'\n\Z', r'\n\\zz new field\n', 'sfmval hm'), ApplyRE.RegExpression('new', 'NEW', 'sfmval zz')]
+        one_at_a_time = lexicon
+        for regex in regexes:
+            one_at_a_time = ApplyRE.apply_narrow_chain([regex], one_at_a_time)[0]
+        self.assertEqual(ApplyRE.apply_narrow_chain(make_regexes()[:2] + regexes[2:], lexicon)[0], one_at_a_time)
+        self.assertTrue('\\hm 2\n\\zz NEW field\n' in one_at_a_time)
+        # The last regex's result is written out as is, even where a re-parse would drop a trailing space.
+        for find, replace, expected in ((r'\n', r'\n\\de \n', '\\ge b\n\\de \n\n\\de \n'), ('^', r'\\zz ', '\\ge \\zz b\n\\zz \n\\zz ')):
+            regexes = make_regexes()[:1] + [ApplyRE.RegExpression(find, replace, 'sfmval ge')]
+            self.assertEqual(ApplyRE.apply_narrow_chain(regexes, '\\lx a\n\\ge b\n\n')[0], '\\lx a\n' + expected)
+
+    def test_prefilter(self):
+        self.assertEqual(ApplyRE.required_literal(re.compile(r'\\lx (ab)+c')), '\\lx ')
+        self.assertIsNone(ApplyRE.required_literal(re.compile('[ab]c?')))
+        self.assertIsNone(ApplyRE.required_literal(re.compile('gloss', re.IGNORECASE)))
+        filtered, unfiltered = [[ApplyRE.RegExpression('d$', 'D', 'sfmval ge'), ApplyRE.RegExpression('xyz', '', 'broad')] for _ in range(2)]
+        for regex in unfiltered:
+            regex._literal = None
+        self.assertEqual(apply_serially(filtered, lexicon), apply_serially(unfiltered, lexicon))
+        self.assertEqual([r.skipped for r in filtered], [1, 1])  # (only the 'gloss' field lacks a 'd')
+        self.assertEqual([r.skipped for r in unfiltered], [0, 0])
+
+    def test_profile(self):
+        regexes = make_regexes()
+        for regex in regexes:
+            regex.profile = ApplyRE.RegexProfile()
+        counts = ApplyRE.apply_narrow_chain(regexes[:2], lexicon)[1] + ApplyRE.apply_broad(regexes[2:3], lexicon)[1]
+        with tempfile.TemporaryDirectory() as folder:
+            fname = os.path.join(folder, 'out.txt')
+            with redirect_stdout(io.StringIO()):
+                ApplyRE.write_profile(regexes, fname, 0.5)
+            with open(fname + '.profile.json', encoding='utf-8') as infile:
+                rows = json.load(infile)['regexes']
+            with open(fname + '.profile.csv', encoding='utf-8') as infile:
+                self.assertEqual(len(infile.read().splitlines()), 1 + len(regexes))
+        self.assertEqual([row['substitutions'] for row in rows[:3]], counts)
+        self.assertEqual([row['fields_scanned'] for row in rows[:2]], [2, 2])  # (just the fields that have the literal in them)
+        self.assertEqual(rows[3]['substitutions'], 0)
+
+    def test_fusion(self):
+        def broad(*pairs):
+            return [ApplyRE.RegExpression(find, replace, 'broad') for find, replace in pairs]
+        pairs = (('é', 'e'), (r'v\n', 'V\n'), ('gloss', 'GLOSS'))
+        regexes = broad(*pairs)
+        self.assertEqual([len(group) for group in ApplyRE.group_regexes(regexes, fuse=True)], [3])
+        self.assertEqual(ApplyRE.apply_broad(regexes, lexicon), (apply_serially(broad(*pairs), lexicon), [2, 2, 2]))
+        chained = broad(('é', 'e'), ('e', 'E'))  # (the second one matches what the first one produces)
+        self.assertEqual([len(group) for group in ApplyRE.group_regexes(chained, fuse=True)], [1, 1])
+        with redirect_stdout(io.StringIO()):
+            self.assertTrue(ApplyRE.verify_fusion(regexes + chained, lexicon))
+
+    def test_parallel(self):
+        with ProcessPoolExecutor(1) as executor:
+            for extra in ([], [r'\n+\Z']):  # (that one makes a record run into the next, so a chunk gets re-run serially)
+                a, b = [make_regexes()[:2] + [ApplyRE.RegExpression(f, '', 'sfmval xn') for f in extra] for _ in range(2)]
+                for regex in a + b:
+                    regex.profile = ApplyRE.RegexProfile()
+                self.assertEqual(ApplyRE.apply_narrow_chain(a, lexicon), ApplyRE.apply_narrow_parallel(executor, b, lexicon, chunks=4))
+                self.assertEqual([r.profile.substitutions for r in a], [r.profile.substitutions for r in b])
+
+
+class TestApplyREScript(unittest.TestCase):
+    def test_options(self):
+        with tempfile.TemporaryDirectory() as folder:
+            infile, regexfile = os.path.join(folder, 'lexicon.txt'), os.path.join(folder, 'regexes.txt')
+            for fname, text in ((infile, lexicon), (regexfile, regex_config)):
+                with open(fname, 'w', encoding='utf-8') as outfile:
+                    outfile.write(text)
+            def run(name, **options):
+                args = dict(infile=infile, outfile=os.path.join(folder, name), regexfile=regexfile, overwr=True, workers=1)
+                args.update(options)
+                with redirect_stdout(io.StringIO()):
+                    ApplyRE.execute(args)
+                with open(args['outfile'], encoding='utf-8') as result:
+                    return result.read()
+            expected = run('default.txt')
+            self.assertEqual(expected, apply_serially(make_regexes(), lexicon))
+            for options in (dict(workers=2), dict(stream=True), dict(cache=True), dict(cache=True), dict(fuse=True), dict(profile=True)):
+                self.assertEqual(run('out.txt', **options), expected, options)
+            run('delta.txt', delta=True)
+            out = io.StringIO()
+            with open(infile, encoding='utf-8') as original, open(os.path.join(folder, 'delta.txt'), encoding='utf-8', newline='') as patch:
+                apply_delta(original, patch, out)
+            self.assertEqual(out.getvalue(), expected)
+
+
 class TestCaseRf(unittest.TestCase):
 
     def test_rf_insert(self):